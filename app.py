@@ -2,20 +2,40 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import hashlib
 import json
-import sys
+from datetime import datetime
+from itertools import groupby
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, jsonify
 from flask_moment import Moment
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from itsdangerous import exc
+from sqlalchemy import tuple_
+from sqlalchemy.orm.exc import StaleDataError
 from forms import *
-from models import Venue, Artist, Show
+from models import db, Venue, Artist, Show, ShowArchive, Ticket
+from recurrence import expand_occurrences, validate_occurrences, insert_shows, RecurrenceError
+from ratelimit import RateLimiter, LoadShedder
+from idempotency import Idempotency
+from telemetry import Telemetry
+from request_logging import RequestLogger
+from metrics import Metrics
+from profiling import Profiler
+from cache import ListingCache, LocalCache, FragmentCache
+from events import EventHub
+from snapshots import Snapshots
+from invalidation import InvalidationBus, record
+from ical import feed_rows, feed_version, calendar
+from sitemaps import Sitemaps
+from compression import Compression
+from trending import TrendingViews
+from projections import Listed, Area, ShowTile, project, listed, show_tiles
+from tickets import create_tickets, hold, purchase, release, availability, TicketError, SoldOut, ShowStarted
+from partitions import shows_cli
+from matching import index_venue, index_artist, venues_for_artist, artists_for_venue, INDEXED_ATTRIBUTES
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -24,8 +44,22 @@ from models import Venue, Artist, Show
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db.init_app(app)
 migrate = Migrate(app, db, compare_type=True)
+listing_cache = ListingCache(app)
+invalidation = InvalidationBus(app, listing_cache)
+app.jinja_env.add_extension(FragmentCache)
+app.jinja_env.fragment_cache = LocalCache(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+events = EventHub(app)
+trending = TrendingViews(app, listing_cache)
+app.cli.add_command(shows_cli)
+telemetry = Telemetry(app)
+# Its before_request answers snapshot hits, so it comes after telemetry's:
+# those requests are still timed, logged and counted
+snapshots = Snapshots(app, listing_cache)
+limiter = RateLimiter(app)
+shedder = LoadShedder(app)
+idempotency = Idempotency(app)
 
 # db.init_app(app)
 # with app.app_context():
@@ -63,45 +97,21 @@ def areas():
   """
   Get the grouping of venues into areas
   """
-  cities = []
-  states = []
-  areas = {}
+  # One query, ordered so that venues of the same city and state are adjacent
+  rows = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state).order_by(
+    Venue.state, Venue.city, Venue.id)
 
-  # Collect all cities and states in the Venue database
-  for venue in Venue.query.all():
-    cities.append(venue.city)
-    states.append(venue.state)
-
-  # Connect / zip each city with corresponding state
-  cities_states = list(zip(cities, states))
-  # Make the list unique
-  cities_states = list(set(cities_states))
-
-  # For each tuple of cities_states, group all venues belonging to that category
-  for i in range(len(cities_states)):
-    areas[cities_states[i]] = []
-    for venue in Venue.query.all():
-      if venue.city == cities_states[i][0] and venue.state == cities_states[i][1]:
-        areas[cities_states[i]].append(venue)
-
-  # Create
-  new_areas = []
-
-  for key, value in areas.items():
-      mod_area = {}
-      mod_area['city'] = key[0]
-      mod_area['state'] = key[1]
-      mod_area['venues'] = value
-      new_areas.append(mod_area)
-
-  return new_areas
+  return [
+    Area(city, state, tuple(Listed(venue.id, venue.name) for venue in venues))
+    for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state))
+  ]
 
 
 @app.route('/venues')
 def venues():
   # TODO: replace with real venues data.
   #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  data=areas()
+  data = listing_cache.get_or_build('areas', ('venues',), areas)
   return render_template('pages/venues.html', areas=data)
 
 @app.route('/venues/search', methods=['POST'])
@@ -112,8 +122,8 @@ def search_venues():
 
   search_query = request.form.get('search_term', '').strip()
 
-  query_venues = Venue.query.filter(Venue.name.ilike(
-    '%{}%'.format(search_query))).all()
+  query_venues = project(Listed, listed(Venue).filter(Venue.name.ilike(
+    '%{}%'.format(search_query))).order_by(Venue.id))
 
   response = {
     "count": len(query_venues),
@@ -124,10 +134,97 @@ def search_venues():
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
+  # upcoming shows in full, past shows one page at a time (see venue_past_shows)
+  venue = Venue.query.get_or_404(venue_id)
+  past, next_page = past_shows_page('venue_id', venue_id, 'venue_past_shows', venue_id=venue_id)
+  trending.viewed('venue', venue_id)
+  return render_template('pages/show_venue.html', venue=venue, upcoming=upcoming_shows('venue_id', venue_id),
+                         past=past, next_page=next_page)
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  # artists seeking a venue, ranked by shared genres and then by location
+  venue = Venue.query.get_or_404(venue_id)
+  return render_template('pages/matches.html', entity=venue, kind='artists',
+                         matches=artists_for_venue(venue, app.config['MATCHES_PER_PAGE']))
+
+def show_feed(name, tag, *criteria):
+  """
+  Stream the matching shows as an iCalendar feed. Its ETag is a digest of
+  the shows and of when their venues and artists last changed, so it is the
+  same on every worker. The digest is kept in the listing cache until a show,
+  venue or artist is written, so a calendar app polling a feed that has not
+  changed gets a 304 from a cache lookup. tag must be safe in a header.
+  """
+  version = listing_cache.get_or_build('feed_version', ('shows', 'venues', 'artists'),
+                                       lambda: feed_version(*criteria), key=tag)
+  etag = '{}-{}'.format(tag, version)
+  if request.if_none_match.contains_weak(etag):
+    response = Response(status=304)
+  else:
+    response = Response(stream_with_context(calendar(
+      name, feed_rows(*criteria), request.url_root, app.config['CALENDAR_SHOW_HOURS'])),
+      mimetype='text/calendar')
+  response.set_etag(etag, weak=True)
+  return response
+
+def upcoming_shows(column, entity_id):
+  return project(ShowTile, show_tiles(Show).filter(
+    getattr(Show, column) == entity_id, Show.start_time > datetime.utcnow()).order_by(Show.start_time, Show.id))
 
-  # data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-  return render_template('pages/show_venue.html', venue=Venue.query.filter_by(id=venue_id).order_by('id').first())
+def past_shows_page(column, entity_id, endpoint, **values):
+  """
+  One page of past shows, newest first, and the URL of the next page (None
+  on the last one). The page is keyed on the (start_time, id) of the last
+  show already sent, taken from the before/before_id query arguments, and
+  runs across Show and ShowArchive; each table is read through its
+  (<column>, start_time, id) index for at most one page, so the cost stays
+  the same however long the history is.
+  """
+  limit = app.config['PAST_SHOWS_PER_PAGE']
+  before = None
+  if 'before' in request.args:
+    try:
+      before = (datetime.fromisoformat(request.args['before']), int(request.args['before_id']))
+    except (KeyError, ValueError):
+      abort(400)
+
+  rows = []
+  for table in (Show, ShowArchive):
+    query = show_tiles(table).filter(getattr(table, column) == entity_id, table.start_time < datetime.utcnow())
+    if before:
+      query = query.filter(tuple_(table.start_time, table.id) < tuple_(*before))
+    rows.extend(project(ShowTile, query.order_by(table.start_time.desc(), table.id.desc()).limit(limit + 1)))
+  rows.sort(key=lambda row: (row.start_time, row.id), reverse=True)
+
+  if len(rows) <= limit:
+    return rows, None
+  last = rows[limit - 1]
+  return rows[:limit], url_for(endpoint, before=last.start_time.isoformat(), before_id=last.id, **values)
+
+def past_shows_fragment(column, entity_id, endpoint, other, **values):
+  shows, next_page = past_shows_page(column, entity_id, endpoint, **values)
+  response = app.make_response(render_template('pages/show_tiles.html', shows=shows, other=other))
+  if next_page:
+    response.headers['X-Next-Page'] = next_page
+  return response
+
+@app.route('/venues/<int:venue_id>/past_shows')
+def venue_past_shows(venue_id):
+  # fragment loaded page by page by the venue page; the next page is in X-Next-Page
+  return past_shows_fragment('venue_id', venue_id, 'venue_past_shows', 'artist', venue_id=venue_id)
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+def venue_calendar(venue_id):
+  venue = Venue.query.get_or_404(venue_id)
+  return show_feed(venue.name, 'venue-{}'.format(venue_id), Show.venue_id == venue_id)
+
+@app.route('/areas/<state>/<city>/shows.ics')
+def area_calendar(state, city):
+  # The path segments can hold anything, so the tag is a digest of them
+  area = hashlib.sha1('{}\0{}'.format(state, city).encode()).hexdigest()[:16]
+  return show_feed('{}, {}'.format(city, state), 'area-' + area,
+                   Venue.state == state, Venue.city == city)
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -158,6 +255,8 @@ def create_venue_submission():
     venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website=website, seeking_talent=seeking_talent, seeking_description=seeking_description)
 
     db.session.add(venue)
+    db.session.flush()
+    index_venue(venue)
     db.session.commit()
 
   # on successful db insert, flash success
@@ -166,9 +265,9 @@ def create_venue_submission():
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-    print(e); print()
     db.session.rollback()
-    print(sys.exc_info())
+    idempotency.failed()
+    app.logger.exception('Venue %r could not be listed', request.form.get('name'))
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
     return redirect(url_for('create_venue_submission'))
   finally:
@@ -180,32 +279,44 @@ def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   try:
-    venue_name = Venue.query.get(venue_id).name
-    print(venue_name)
-
+    venue = Venue.query.get(venue_id)
+    # Read before the delete: city streams are told by the venue's city
+    venue_name, city, state = venue.name, venue.city, venue.state
+
+    # Tickets have no foreign key to cascade from their show
+    Ticket.query.filter(Ticket.show_id.in_(
+      db.session.query(Show.id).filter(Show.venue_id == venue_id).union_all(
+        db.session.query(ShowArchive.id).filter(ShowArchive.venue_id == venue_id)))).delete(synchronize_session=False)
     Venue.query.filter_by(id=venue_id).delete()
+    record(db.session, 'venue', int(venue_id), 'deleted')
 
     db.session.commit()
+    events.publish('deleted', venue_id=int(venue_id), city=city, state=state)
     flash('Venue "{}" was successfully deleted.'.format(venue_name))
     return redirect(url_for('index'))
   except Exception:
     db.session.rollback()
     flash('Something went wrong, venue "{}" could not be deleted.'.format(venue_id))
-    print(sys.exc_info())
+    app.logger.exception('Venue %s could not be deleted', venue_id)
   finally:
     db.session.close()
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  data = areas()
-  return redirect(url_for('venues', areas=data))
+  return redirect(url_for('venues'))
 
 #  Artists
 #  ----------------------------------------------------------------
+def artist_listing():
+  """
+  Ids and names of every artist, for the artists page
+  """
+  return project(Listed, listed(Artist).order_by(Artist.id))
+
 @app.route('/artists')
 def artists():
   # TODO: replace with real data returned from querying the database
-  data = Artist.query.all()
+  data = listing_cache.get_or_build('artists', ('artists',), artist_listing)
 
   return render_template('pages/artists.html', artists=data)
 
@@ -217,8 +328,8 @@ def search_artists():
 
   search_query = request.form.get('search_term', '').strip()
 
-  query_artists = Artist.query.filter(Artist.name.ilike(
-    '%{}%'.format(search_query))).all()
+  query_artists = project(Listed, listed(Artist).filter(Artist.name.ilike(
+    '%{}%'.format(search_query))).order_by(Artist.id))
 
   response = {
     "count": len(query_artists),
@@ -230,11 +341,45 @@ def search_artists():
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-  return render_template('pages/show_artist.html', artist=Artist.query.filter_by(id=artist_id).order_by('id').first())
+  # upcoming shows in full, past shows one page at a time (see artist_past_shows)
+  artist = Artist.query.get_or_404(artist_id)
+  past, next_page = past_shows_page('artist_id', artist_id, 'artist_past_shows', artist_id=artist_id)
+  trending.viewed('artist', artist_id)
+  return render_template('pages/show_artist.html', artist=artist, upcoming=upcoming_shows('artist_id', artist_id),
+                         past=past, next_page=next_page)
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+def artist_calendar(artist_id):
+  artist = Artist.query.get_or_404(artist_id)
+  return show_feed(artist.name, 'artist-{}'.format(artist_id), Show.artist_id == artist_id)
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  # venues seeking talent, ranked by shared genres and then by location
+  artist = Artist.query.get_or_404(artist_id)
+  return render_template('pages/matches.html', entity=artist, kind='venues',
+                         matches=venues_for_artist(artist, app.config['MATCHES_PER_PAGE']))
+
+@app.route('/artists/<int:artist_id>/past_shows')
+def artist_past_shows(artist_id):
+  # fragment loaded page by page by the artist page; the next page is in X-Next-Page
+  return past_shows_fragment('artist_id', artist_id, 'artist_past_shows', 'venue', artist_id=artist_id)
 
 #  Update
 #  ----------------------------------------------------------------
+def apply_changes(obj, values):
+  """
+  Set only the attributes whose value differs, so the UPDATE names only the
+  changed columns. Returns the names of the changed attributes.
+  """
+  changed = [key for key, value in values.items() if getattr(obj, key) != value]
+  for key in changed:
+    setattr(obj, key, values[key])
+  return changed
+
+def edit_conflict_message(kind, name):
+  return '{} {} was changed by someone else while you were editing. Review the current values and save again.'.format(kind, name)
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
@@ -244,6 +389,7 @@ def edit_artist(artist_id):
     return redirect(url_for('artist'))
   else:
     form = ArtistForm(obj=artist)
+    form.website_link.data = artist.website
 
   artist={
     "id": artist_id,
@@ -268,24 +414,44 @@ def edit_artist_submission(artist_id):
   artist = Artist.query.get(artist_id)
 
   if artist:
-    try:
-      artist.name = request.form.get('name')
-      artist.city = request.form.get('city')
-      artist.state = request.form.get('state')
-      artist.phone = request.form.get('phone')
-      artist.genres = request.form.getlist('genres')
-      artist.seeking_venue = True if 'seeking_venue' in request.form else False
-      artist.seeking_description = request.form.get('seeking_description')
-      artist.image_link = request.form.get('image_link')
-      artist.website = request.form.get('website')
-      artist.facebook_link = request.form.get('facebook_link')
-
-      db.session.commit()
-      flash('Artist ' + artist.name + ' was successfully updated!')
+    # The form carries the version it was rendered from; a different one means someone else saved in between
+    if str(artist.version) != request.form.get('version'):
+      db.session.close()
+      flash(edit_conflict_message('Artist', request.form.get('name')))
+      return redirect(url_for('edit_artist', artist_id=artist_id))
 
+    try:
+      changed = apply_changes(artist, {
+        'name': request.form.get('name'),
+        'city': request.form.get('city'),
+        'state': request.form.get('state'),
+        'phone': request.form.get('phone'),
+        'genres': request.form.getlist('genres'),
+        'seeking_venue': True if 'seeking_venue' in request.form else False,
+        'seeking_description': request.form.get('seeking_description'),
+        'image_link': request.form.get('image_link'),
+        'website': request.form.get('website_link'),
+        'facebook_link': request.form.get('facebook_link'),
+      })
+
+      if INDEXED_ATTRIBUTES.intersection(changed):
+        index_artist(artist)
+      if changed:
+        db.session.commit()
+        venues = db.session.query(Venue.id, Venue.city).join(Show, Show.venue_id == Venue.id).filter(
+          Show.artist_id == artist_id, Show.start_time > datetime.utcnow()).distinct().all()
+        # The streams of the venues (and cities) where the artist plays next
+        events.publish('updated', artist_id=artist_id, venue_ids=[venue.id for venue in venues],
+                       cities=sorted({venue.city for venue in venues if venue.city}))
+      flash('Artist ' + request.form.get('name') + ' was successfully updated!')
+
+    except StaleDataError:
+      db.session.rollback()
+      flash(edit_conflict_message('Artist', request.form.get('name')))
+      return redirect(url_for('edit_artist', artist_id=artist_id))
     except Exception:
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('Artist %s could not be updated', artist_id)
       flash(
           "An error occurred. Artist "
           + request.form.get("name")
@@ -295,7 +461,7 @@ def edit_artist_submission(artist_id):
     finally:
         db.session.close()
   else:
-    flash("Artist id {} and Artist name {} does not exist".format(artist.id, request.form.get('name')))
+    flash("Artist id {} and Artist name {} does not exist".format(artist_id, request.form.get('name')))
 
   return redirect(url_for('show_artist', artist_id=artist_id))
 
@@ -307,6 +473,7 @@ def edit_venue(venue_id):
     return redirect(url_for('venues'))
   else:
     form = VenueForm(obj=venue)
+    form.website_link.data = venue.website
 
   venue={
     "id": venue_id,
@@ -335,26 +502,41 @@ def edit_venue_submission(venue_id):
   form = VenueForm()
 
   if venue and form.validate():
-    try:
-      venue.name = request.form.get('name')
-      venue.city = request.form.get('city')
-      venue.state = request.form.get('state')
-      venue.address = request.form.get('address')
-      venue.phone = request.form.get('phone')
-      venue.genres = request.form.getlist('genres')
-      venue.seeking_talent = True if 'seeking_talent' in request.form else False
-      venue.seeking_description = request.form.get('seeking_description')
-      venue.image_link = request.form.get('image_link')
-      venue.website = request.form.get('website')
-      venue.facebook_link = request.form.get('facebook_link')
-
-      # db.session.add(venue)
-      db.session.commit()
-      flash('Venue ' + venue.name + ' was successfully updated!')
+    # The form carries the version it was rendered from; a different one means someone else saved in between
+    if str(venue.version) != form.version.data:
+      db.session.close()
+      flash(edit_conflict_message('Venue', form.name.data))
+      return redirect(url_for('edit_venue', venue_id=venue_id))
 
+    try:
+      changed = apply_changes(venue, {
+        'name': request.form.get('name'),
+        'city': request.form.get('city'),
+        'state': request.form.get('state'),
+        'address': request.form.get('address'),
+        'phone': request.form.get('phone'),
+        'genres': request.form.getlist('genres'),
+        'seeking_talent': True if 'seeking_talent' in request.form else False,
+        'seeking_description': request.form.get('seeking_description'),
+        'image_link': request.form.get('image_link'),
+        'website': request.form.get('website_link'),
+        'facebook_link': request.form.get('facebook_link'),
+      })
+
+      if INDEXED_ATTRIBUTES.intersection(changed):
+        index_venue(venue)
+      if changed:
+        db.session.commit()
+        events.publish('updated', venue_id=venue_id, city=venue.city, state=venue.state)
+      flash('Venue ' + request.form.get('name') + ' was successfully updated!')
+
+    except StaleDataError:
+      db.session.rollback()
+      flash(edit_conflict_message('Venue', request.form.get('name')))
+      return redirect(url_for('edit_venue', venue_id=venue_id))
     except Exception:
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('Venue %s could not be updated', venue_id)
       flash(
           "An error occurred. Venue "
           + request.form.get("name")
@@ -364,7 +546,7 @@ def edit_venue_submission(venue_id):
     finally:
         db.session.close()
   else:
-    flash("Venue id {} and Venue name {} does not exist".format(venue.id, request.form.get('name')))
+    flash("Venue id {} and Venue name {} does not exist".format(venue_id, request.form.get('name')))
     return redirect(url_for('index'))
 
   return redirect(url_for('show_venue', venue_id=venue_id))
@@ -398,13 +580,16 @@ def create_artist_submission():
     artist = Artist(name=name, city=city, state=state,phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website=website, seeking_venue=seeking_venue, seeking_description=seeking_description)
 
     db.session.add(artist)
+    db.session.flush()
+    index_artist(artist)
     db.session.commit()
 
     # on successful db insert, flash success
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except Exception:
     db.session.rollback()
-    print(sys.exc_info())
+    idempotency.failed()
+    app.logger.exception('Artist %r could not be listed', request.form.get('name'))
     # TODO: on unsuccessful db insert, flash an error instead.
     # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
     flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
@@ -417,11 +602,17 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def show_listing():
+  """
+  Every show with its artist and venue, joined in one query
+  """
+  return project(ShowTile, show_tiles(Show).order_by(Show.start_time, Show.id))
+
 @app.route('/shows')
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
-  data = Show.query.all()
+  data = listing_cache.get_or_build('shows', ('shows', 'artists', 'venues'), show_listing)
   return render_template('pages/shows.html', shows=data)
 
 @app.route('/shows/create', methods=['GET'])
@@ -433,22 +624,54 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
-
-  try:
-    artist_id = request.form.get('artist_id')
-    venue_id = request.form.get('venue_id')
+  # a recurring show is expanded here and all of its dates are listed in one transaction
+  form = ShowForm()
 
-    show = Show(artist_id=artist_id, venue_id=venue_id)
+  if not form.validate():
+    for field, errors in form.errors.items():
+      flash('{}: {}'.format(field, ', '.join(errors)))
+    idempotency.failed()
+    return redirect(url_for('create_shows'))
 
-    db.session.add(show)
+  try:
+    occurrences = expand_occurrences(
+      form.start_time.data,
+      form.recurrence.data,
+      count=form.recurrence_count.data,
+      until=form.recurrence_until.data,
+      interval=form.recurrence_interval.data,
+      limit=app.config['MAX_SHOW_OCCURRENCES'])
+    rows = validate_occurrences(form.artist_id.data, form.venue_id.data, occurrences)
+    if form.capacity.data and form.capacity.data * len(rows) > app.config['MAX_TICKETS_PER_SUBMISSION']:
+      raise RecurrenceError('At most {} seats can be put on sale at once; list fewer dates or seats.'.format(
+        app.config['MAX_TICKETS_PER_SUBMISSION']))
+    for row in rows:
+      row['capacity'] = form.capacity.data
+
+    show_ids = insert_shows(rows)
+    create_tickets(show_ids, form.capacity.data)
+    listed = len(show_ids)
+    for show_id in show_ids:
+      record(db.session, 'show', show_id, 'created')
     db.session.commit()
+    venue = Venue.query.get(form.venue_id.data)
+    events.publish('created', venue_id=venue.id, artist_id=int(form.artist_id.data), city=venue.city,
+                   state=venue.state, start_times=[row['start_time'] for row in rows])
 
     # on successful db insert, flash success
-    flash('Show was successfully listed!')
+    if listed == 1:
+      flash('Show was successfully listed!')
+    else:
+      flash('{} shows were successfully listed!'.format(listed))
+  except RecurrenceError as e:
+    db.session.rollback()
+    idempotency.failed()
+    flash('Show could not be listed. {}'.format(e))
+    return redirect(url_for('create_shows'))
   except Exception:
     db.session.rollback()
-    print(sys.exc_info())
+    idempotency.failed()
+    app.logger.exception('Show could not be listed')
     # TODO: on unsuccessful db insert, flash an error instead.
     flash('An error occurred. Show could not be listed.')
     return redirect(url_for('create_show_submission'))
@@ -457,24 +680,76 @@ def create_show_submission():
 
   return redirect(url_for('shows'))
 
+#  Tickets
+#  ----------------------------------------------------------------
+
+@app.route('/shows/<int:show_id>/tickets')
+def show_tickets(show_id):
+  # seats of a ticketed show by state
+  return jsonify(availability(show_id))
+
+@app.route('/shows/<int:show_id>/holds', methods=['POST'])
+def hold_tickets(show_id):
+  # hold {"quantity": n} seats for TICKET_HOLD_SECONDS, to be bought with the returned token
+  quantity = (request.get_json(silent=True) or request.form).get('quantity', 1)
+  try:
+    quantity = int(quantity)
+  except (TypeError, ValueError):
+    quantity = 0
+  if not 1 <= quantity <= app.config['MAX_TICKETS_PER_HOLD']:
+    return jsonify(error='quantity must be between 1 and {}'.format(app.config['MAX_TICKETS_PER_HOLD'])), 400
+
+  try:
+    token, ticket_ids, until = hold(show_id, quantity, app.config['TICKET_HOLD_SECONDS'])
+    db.session.commit()
+  except SoldOut as e:
+    db.session.rollback()
+    return jsonify(error=str(e)), 409
+  except ShowStarted as e:
+    db.session.rollback()
+    return jsonify(error=str(e)), 410
+  return jsonify(token=token, tickets=ticket_ids, expires_at=until.isoformat() + 'Z'), 201
+
+@app.route('/holds/<token>/purchase', methods=['POST'])
+def purchase_tickets(token):
+  try:
+    ticket_ids = purchase(token)
+    db.session.commit()
+  except TicketError as e:
+    db.session.rollback()
+    return jsonify(error=str(e)), 410
+  return jsonify(tickets=ticket_ids)
+
+@app.route('/holds/<token>', methods=['DELETE'])
+def release_tickets(token):
+  released = release(token)
+  db.session.commit()
+  return jsonify(released=released)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
+@app.errorhandler(429)
+def too_many_requests_error(error):
+    headers = {'Retry-After': error.retry_after} if error.retry_after else {}
+    return render_template('errors/429.html'), 429, headers
+
+@app.errorhandler(503)
+def service_unavailable_error(error):
+    headers = {'Retry-After': error.retry_after} if error.retry_after else {}
+    return render_template('errors/503.html'), 503, headers
+
 @app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+request_logger = RequestLogger(app, telemetry)
+metrics = Metrics(app, telemetry)
+profiler = Profiler(app)
+sitemaps = Sitemaps(app)
+compression = Compression(app)
 
 #----------------------------------------------------------------------------#
 # Launch.
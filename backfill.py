@@ -0,0 +1,126 @@
+import logging
+import time
+from alembic import op
+from flask import current_app
+from sqlalchemy import text
+
+#----------------------------------------------------------------------------#
+# Online backfills for migrations.
+#
+# A data migration that rewrites a large table in one statement holds its
+# row locks, and the migration's DDL locks, until the whole table is done.
+# backfill() instead commits the migration's work so far, then walks the
+# table by primary key range, one short transaction per batch, pausing
+# between batches so the site's own queries keep their share of the
+# database. Each batch commits together with a checkpoint row, so a run that
+# is interrupted resumes after the last batch it finished.
+#
+# Give a backfill its own revision, after the one that adds the columns it
+# fills: an interrupted upgrade is then retried from the backfill, rather
+# than from DDL that has already been committed. The code that writes the
+# table must already fill the column for new rows, since the range is fixed
+# when the backfill starts.
+#
+#   def upgrade():
+#       backfill('venue_slug', 'Venue',
+#                'UPDATE "Venue" SET slug = lower(name) WHERE id >= :start AND id < :stop')
+#----------------------------------------------------------------------------#
+
+logger = logging.getLogger('alembic.backfill')
+
+# Seconds between progress lines
+REPORT_EVERY = 5.0
+
+CREATE_CHECKPOINTS = text(
+    'CREATE TABLE IF NOT EXISTS backfill_checkpoint ('
+    '  name varchar(200) PRIMARY KEY, '
+    '  position bigint NOT NULL, '
+    '  rows bigint NOT NULL, '
+    '  finished boolean NOT NULL, '
+    '  updated_at timestamp NOT NULL)')
+
+LOAD_CHECKPOINT = text('SELECT position, rows, finished FROM backfill_checkpoint WHERE name = :name')
+
+SAVE_CHECKPOINT = text(
+    'INSERT INTO backfill_checkpoint (name, position, rows, finished, updated_at) '
+    'VALUES (:name, :position, :rows, :finished, now() at time zone \'utc\') '
+    'ON CONFLICT (name) DO UPDATE SET position = excluded.position, rows = excluded.rows, '
+    'finished = excluded.finished, updated_at = excluded.updated_at')
+
+FORGET_CHECKPOINT = text('DELETE FROM backfill_checkpoint WHERE name = :name')
+
+
+def duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return '{}m{:02d}s'.format(minutes, seconds) if minutes else '{}s'.format(seconds)
+
+
+def backfill(name, table, update, key='id', batch_size=None, pause=None):
+    """
+    Run update over table one key range at a time. update is either SQL
+    with :start and :stop parameters, applied to the rows with
+    start <= key < stop, or a function update(conn, start, stop) returning
+    the number of rows it changed. name identifies the backfill's checkpoint
+    and must be unique across migrations. batch_size and pause default to
+    BACKFILL_BATCH_SIZE and BACKFILL_PAUSE.
+    """
+    context = op.get_context()
+    if context.as_sql:
+        raise RuntimeError('Backfill "{}" needs a database connection and cannot run in offline mode.'.format(name))
+    batch_size = batch_size or current_app.config.get('BACKFILL_BATCH_SIZE', 1000)
+    pause = current_app.config.get('BACKFILL_PAUSE', 0.1) if pause is None else pause
+    if isinstance(update, str):
+        statement = text(update)
+        update = lambda conn, start, stop: conn.execute(statement, {'start': start, 'stop': stop}).rowcount
+
+    # Commit the migration so far, releasing its locks; every batch then runs
+    # in a transaction of its own
+    with context.autocommit_block():
+        engine = op.get_bind().engine
+        with engine.begin() as conn:
+            conn.execute(CREATE_CHECKPOINTS)
+            checkpoint = conn.execute(LOAD_CHECKPOINT, {'name': name}).first()
+            first, last = conn.execute(text('SELECT min({0}), max({0}) FROM "{1}"'.format(key, table))).first()
+
+        if checkpoint and checkpoint.finished:
+            logger.info('backfill %s: already finished (%s rows)', name, checkpoint.rows)
+            return
+        if first is None:
+            logger.info('backfill %s: "%s" is empty', name, table)
+            return
+
+        position, rows = (checkpoint.position, checkpoint.rows) if checkpoint else (first, 0)
+        if checkpoint:
+            logger.info('backfill %s: resuming at %s = %s', name, key, position)
+        began = reported = time.monotonic()
+        resumed = position
+
+        while position <= last:
+            stop = position + batch_size
+            with engine.begin() as conn:
+                rows += update(conn, position, stop) or 0
+                conn.execute(SAVE_CHECKPOINT, {'name': name, 'position': stop, 'rows': rows, 'finished': False})
+            position = stop
+
+            now = time.monotonic()
+            if now - reported >= REPORT_EVERY:
+                reported = now
+                done = min(position, last + 1)
+                logger.info('backfill %s: %s %s of %s (%.0f%%), %s rows, eta %s', name, key, done, last,
+                            100.0 * (done - first) / (last + 1 - first), rows,
+                            duration((now - began) * (last + 1 - done) / (done - resumed)))
+            if pause and position <= last:
+                time.sleep(pause)
+
+        with engine.begin() as conn:
+            conn.execute(SAVE_CHECKPOINT, {'name': name, 'position': position, 'rows': rows, 'finished': True})
+        logger.info('backfill %s: finished, %s rows in %s', name, rows, duration(time.monotonic() - began))
+
+
+def forget(name):
+    """
+    Drop the checkpoint of a backfill, from the downgrade of its revision,
+    so that upgrading again runs it from the start.
+    """
+    op.execute(CREATE_CHECKPOINTS)
+    op.execute(FORGET_CHECKPOINT.bindparams(name=name))
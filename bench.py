@@ -0,0 +1,453 @@
+"""
+Benchmarks for Fyyur's hot paths.
+
+Run them against a local, disposable database (the one in config.py), e.g.:
+
+  python bench.py recurrence --occurrences 500 --rounds 5
+  python bench.py events --subscribers 5000 --rounds 20
+  python bench.py tickets --buyers 500 --capacity 200 --pool 40
+  python bench.py projections --rows 10000
+  python bench.py compression --rows 2000 --rounds 20
+  python bench.py trending --rounds 5 --threads 8
+
+Every benchmark cleans up the rows it creates. Fyyur has no test suite, so
+two of them double as tests and can run in CI against a throwaway database:
+tickets exits with status 1 when a seat is sold twice, more seats are sold
+than the show has, or a buyer fails, and trending when a stopped worker
+loses views or dies without reporting them.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import render_template
+from app import app
+from models import db, Artist, Venue, Show, Ticket, ViewCount
+from recurrence import expand_occurrences, validate_occurrences, insert_shows
+from events import EventHub
+from projections import Listed, project, listed
+from tickets import create_tickets, hold, purchase, release, availability, SoldOut, HoldExpired
+from compression import available_encoders
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def seed_pair():
+    """
+    Create a throwaway artist and venue to hang benchmark shows on.
+    """
+    artist = Artist(name='bench artist', city='Bench', state='CA', genres=['Jazz'])
+    venue = Venue(name='bench venue', city='Bench', state='CA', genres=['Jazz'])
+    db.session.add_all([artist, venue])
+    db.session.commit()
+    return artist.id, venue.id
+
+
+def drop_pair(artist_id, venue_id):
+    Ticket.query.filter(Ticket.show_id.in_(db.session.query(Show.id).filter(
+        (Show.artist_id == artist_id) | (Show.venue_id == venue_id)))).delete(synchronize_session=False)
+    Show.query.filter((Show.artist_id == artist_id) | (Show.venue_id == venue_id)).delete(synchronize_session=False)
+    Artist.query.filter_by(id=artist_id).delete()
+    Venue.query.filter_by(id=venue_id).delete()
+    db.session.commit()
+
+
+def report(name, count, elapsed):
+    print('{:<32} {:>8} rows {:>9.3f}s {:>12.1f} rows/s'.format(name, count, elapsed, count / elapsed))
+
+#----------------------------------------------------------------------------#
+# Benchmarks.
+#----------------------------------------------------------------------------#
+
+def bench_recurrence(args):
+    """
+    Occurrences inserted per second by the recurring show path, next to the
+    one-commit-per-show path it replaces.
+    """
+    artist_id, venue_id = seed_pair()
+    start = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(days=1)
+    try:
+        total, elapsed = 0, 0.0
+        for i in range(args.rounds):
+            first = start + timedelta(minutes=i)
+            began = time.perf_counter()
+            occurrences = expand_occurrences(first, 'WEEKLY', count=args.occurrences, limit=args.occurrences)
+            total += len(insert_shows(validate_occurrences(artist_id, venue_id, occurrences)))
+            db.session.commit()
+            elapsed += time.perf_counter() - began
+        report('recurring (single INSERT)', total, elapsed)
+
+        total, elapsed = 0, 0.0
+        for i in range(args.rounds):
+            first = start + timedelta(minutes=args.rounds + i)
+            began = time.perf_counter()
+            for occurrence in expand_occurrences(first, 'WEEKLY', count=args.occurrences, limit=args.occurrences):
+                db.session.add(Show(artist_id=artist_id, venue_id=venue_id, start_time=occurrence))
+                db.session.commit()
+                total += 1
+            elapsed += time.perf_counter() - began
+        report('one commit per show', total, elapsed)
+    finally:
+        db.session.rollback()
+        drop_pair(artist_id, venue_id)
+
+
+def bench_events(args):
+    """
+    Fan-out of the show event hub to --subscribers concurrent streams, each
+    read by its own thread as a worker would. Reports the time until every
+    stream has received each event, the time publish() holds up the writer,
+    and the memory held per subscription.
+    Half the streams filter on a city that only some events carry.
+    """
+    hub = EventHub()
+    threading.stack_size(256 * 1024)
+    received = threading.Semaphore(0)
+    expected = 0
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    subscriptions = [
+        hub.subscribe(city='Bench' if i % 2 else None) for i in range(args.subscribers)
+    ]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    def read(subscription):
+        for message in hub.events(subscription):
+            if message.startswith('id:'):
+                received.release()
+
+    readers = [threading.Thread(target=read, args=(sub,), daemon=True) for sub in subscriptions]
+    for reader in readers:
+        reader.start()
+
+    latencies, publishing = [], []
+    for i in range(args.rounds):
+        city = 'Bench' if i % 2 else 'Elsewhere'
+        receivers = args.subscribers if city == 'Bench' else args.subscribers - args.subscribers // 2
+        began = time.perf_counter()
+        hub.publish('created', venue_id=1, city=city, start_times=[datetime.utcnow()])
+        publishing.append(time.perf_counter() - began)
+        for _ in range(receivers):
+            received.acquire()
+        latencies.append(time.perf_counter() - began)
+        expected += receivers
+
+    print('{} subscribers, {} events, {} deliveries'.format(args.subscribers, args.rounds, expected))
+    print('memory per subscription   {:>10.0f} bytes'.format(held / args.subscribers))
+    print('publish, worst            {:>10.3f} ms'.format(max(publishing) * 1000))
+    print('fan-out, median           {:>10.1f} ms'.format(sorted(latencies)[len(latencies) // 2] * 1000))
+    print('fan-out, worst            {:>10.1f} ms'.format(max(latencies) * 1000))
+    print('deliveries/s              {:>10.0f}'.format(expected / sum(latencies)))
+
+
+def bench_tickets(args):
+    """
+    Stress check of the ticket inventory: --buyers threads race for the
+    --capacity seats of one show over a pool of --pool connections. Most
+    buyers pay for their hold, some release it and some let it lapse, so
+    seats change hands while the race is on. Exits with status 1 if a seat
+    is sold twice, more seats are sold than the show has, or a buyer thread
+    dies before it has an outcome.
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': args.pool, 'max_overflow': 0, 'pool_timeout': 120}
+    artist_id, venue_id = seed_pair()
+    show_id, = insert_shows([{
+        'artist_id': artist_id, 'venue_id': venue_id, 'capacity': args.capacity,
+        'start_time': datetime.utcnow().replace(microsecond=0) + timedelta(days=30),
+    }])
+    create_tickets([show_id], args.capacity)
+    db.session.commit()
+
+    lock = threading.Lock()
+    sold, outcomes, latencies = [], Counter(), []
+
+    def buy(buyer):
+        rng = random.Random(buyer)
+        with app.app_context():
+            for attempt in range(5):
+                lapse = rng.random() < 0.1
+                began = time.perf_counter()
+                try:
+                    token, ticket_ids, until = hold(show_id, rng.randint(1, 4), 0.05 if lapse else 60)
+                    db.session.commit()
+                except SoldOut:
+                    db.session.rollback()
+                    outcome = 'sold out'
+                    time.sleep(0.01)
+                    continue
+                finally:
+                    with lock:
+                        latencies.append(time.perf_counter() - began)
+
+                # Checking out
+                time.sleep(rng.uniform(0, 0.02) + (0.1 if lapse else 0))
+                if rng.random() < 0.1:
+                    release(token)
+                    db.session.commit()
+                    outcome = 'released'
+                    break
+                try:
+                    bought = purchase(token)
+                    db.session.commit()
+                except HoldExpired:
+                    db.session.rollback()
+                    outcome = 'hold lapsed'
+                    break
+                with lock:
+                    sold.extend(bought)
+                outcome = 'bought'
+                break
+            with lock:
+                outcomes[outcome] += 1
+
+    try:
+        began = time.perf_counter()
+        buyers = [threading.Thread(target=buy, args=(i,)) for i in range(args.buyers)]
+        for buyer in buyers:
+            buyer.start()
+        for buyer in buyers:
+            buyer.join()
+        elapsed = time.perf_counter() - began
+
+        seats = availability(show_id)
+        in_db = db.session.query(db.func.count()).filter(Ticket.show_id == show_id, Ticket.status == 'sold').scalar()
+        latencies.sort()
+        print('{} buyers for {} seats in {:.2f}s'.format(args.buyers, args.capacity, elapsed))
+        print('outcomes         ', dict(outcomes))
+        print('seats            ', seats)
+        print('hold latency     p50 {:.1f} ms, p99 {:.1f} ms'.format(
+            latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+
+        problems = []
+        if sum(outcomes.values()) != args.buyers:
+            problems.append('{} buyers failed'.format(args.buyers - sum(outcomes.values())))
+        if len(sold) != len(set(sold)):
+            problems.append('a seat was sold twice')
+        if len(sold) != in_db:
+            problems.append('{} seats bought but {} marked sold'.format(len(sold), in_db))
+        if in_db > args.capacity:
+            problems.append('{} seats sold out of {}'.format(in_db, args.capacity))
+        if problems:
+            raise SystemExit('OVERSOLD: ' + '; '.join(problems))
+        print('ok: {} seats sold, none twice, none beyond capacity'.format(in_db))
+    finally:
+        db.session.rollback()
+        drop_pair(artist_id, venue_id)
+
+
+def bench_projections(args):
+    """
+    Memory held by --rows artists loaded three ways (ORM instances, dicts
+    of the selected columns, Listed named tuples) and the time to render
+    the artists page from each.
+    """
+    db.session.execute(Artist.__table__.insert(), [{
+        'name': 'bench projection {}'.format(i), 'city': 'Bench', 'state': 'CA', 'genres': ['Jazz', 'Rock'],
+        'seeking_venue': True, 'seeking_description': 'Looking for a room to play in. ' * 10,
+    } for i in range(args.rows)])
+    db.session.commit()
+    bench_artists = Artist.name.like('bench projection %')
+
+    loaders = [
+        ('ORM instances', lambda: Artist.query.filter(bench_artists).order_by(Artist.id).all()),
+        ('dicts', lambda: [{'id': row.id, 'name': row.name}
+                           for row in listed(Artist).filter(bench_artists).order_by(Artist.id)]),
+        ('named tuples', lambda: project(Listed, listed(Artist).filter(bench_artists).order_by(Artist.id))),
+    ]
+    try:
+        print('{:<16} {:>14} {:>12} {:>12}'.format('', 'bytes/10k rows', 'load', 'render'))
+        for name, load in loaders:
+            db.session.expunge_all()
+            tracemalloc.start()
+            began = time.perf_counter()
+            rows = load()
+            loaded = time.perf_counter() - began
+            held, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            renders = []
+            with app.test_request_context('/artists'):
+                for _ in range(args.rounds):
+                    began = time.perf_counter()
+                    render_template('pages/artists.html', artists=rows)
+                    renders.append(time.perf_counter() - began)
+            print('{:<16} {:>14.0f} {:>10.1f}ms {:>10.1f}ms'.format(
+                name, held * 10000 / len(rows), loaded * 1000, sorted(renders)[len(renders) // 2] * 1000))
+            del rows
+    finally:
+        db.session.rollback()
+        db.session.expunge_all()
+        Artist.query.filter(bench_artists).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def bench_compression(args):
+    """
+    CPU time and bytes saved by each installed encoding and level on the
+    venues, artists and shows pages (with --rows extra shows listed), then
+    the cost of a whole /shows request with and without compression.
+    """
+    artist_id, venue_id = seed_pair()
+    start = datetime.utcnow() + timedelta(days=1)
+    db.session.execute(Show.__table__.insert(), [
+        {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start + timedelta(hours=i)}
+        for i in range(args.rows)])
+    db.session.commit()
+    client = app.test_client()
+    levels = {'gzip': (1, 6, 9), 'br': (1, 4, 6, 9), 'zstd': (1, 3, 9, 15)}
+    try:
+        print('{:<10} {:>10} {:<6} {:>5} {:>10} {:>7} {:>10} {:>10}'.format(
+            'page', 'bytes', 'coding', 'level', 'encoded', 'ratio', 'cpu', 'MB/s'))
+        for path in ('/venues', '/artists', '/shows'):
+            body = client.get(path).get_data()
+            for coding, encoder in sorted(available_encoders().items()):
+                for level in levels[coding]:
+                    began = time.process_time()
+                    for _ in range(args.rounds):
+                        compressor = encoder(level)
+                        encoded = compressor.compress(body) + compressor.finish()
+                    cpu = (time.process_time() - began) / args.rounds
+                    print('{:<10} {:>10} {:<6} {:>5} {:>10} {:>6.1f}x {:>8.2f}ms {:>10.1f}'.format(
+                        path, len(body), coding, level, len(encoded), len(body) / len(encoded), cpu * 1000,
+                        len(body) / cpu / 1e6 if cpu else float('inf')))
+
+        print()
+        print('{:<24} {:>10} {:>10}'.format('GET /shows', 'bytes', 'cpu'))
+        for coding in ['identity'] + sorted(available_encoders()):
+            samples = []
+            for _ in range(args.rounds):
+                began = time.process_time()
+                size = len(client.get('/shows', headers={'Accept-Encoding': coding}).get_data())
+                samples.append(time.process_time() - began)
+            print('{:<24} {:>10} {:>8.1f}ms'.format(
+                'Accept-Encoding: ' + coding, size, sorted(samples)[len(samples) // 2] * 1000))
+    finally:
+        drop_pair(artist_id, venue_id)
+
+
+def trending_worker(venue_id, artist_id, threads, interval):
+    """
+    Stand in for a web worker: record views of the pair from several
+    threads, flushing every `interval` seconds, until SIGTERM. Then exit the
+    way a gunicorn worker does, through SystemExit, so the counts still in
+    memory are left to the atexit flush. Prints how many views it recorded.
+    """
+    trending = app.extensions['trending']
+    trending.interval = interval
+    trending.start()
+    stop = threading.Event()
+    recorded = Counter()
+
+    def view(kind, entity_id):
+        count = 0
+        while not stop.is_set():
+            trending.viewed(kind, entity_id)
+            count += 1
+        recorded[kind] += count
+
+    workers = [threading.Thread(target=view, args=(('venue', venue_id), ('artist', artist_id))[i % 2])
+               for i in range(threads)]
+
+    def terminate(signum, frame):
+        stop.set()
+        for worker in workers:
+            worker.join()
+        print(json.dumps(recorded), flush=True)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    for worker in workers:
+        worker.start()
+    print('ready', flush=True)
+    while True:
+        time.sleep(1)
+
+
+def bench_trending(args):
+    """
+    Check that no view is lost when a worker is stopped: run trending_worker
+    in a child process, SIGTERM it mid-flush, and compare the views it
+    recorded with the ViewCount rows it left. Exits with status 1 if any
+    view is lost or the worker does not report.
+    """
+    artist_id, venue_id = seed_pair()
+    code = 'import config; config.SQLALCHEMY_DATABASE_URI = {!r}; import bench; bench.trending_worker({}, {}, {}, {})'.format(
+        app.config['SQLALCHEMY_DATABASE_URI'], venue_id, artist_id, args.threads, args.interval)
+    pair = ((ViewCount.kind == 'venue') & (ViewCount.entity_id == venue_id)) | (
+        (ViewCount.kind == 'artist') & (ViewCount.entity_id == artist_id))
+    lost = 0
+    try:
+        print('{:>5} {:>12} {:>12} {:>8} {:>12}'.format('round', 'recorded', 'in table', 'lost', 'views/s'))
+        for round in range(args.rounds):
+            before = db.session.query(db.func.coalesce(db.func.sum(ViewCount.views), 0)).filter(pair).scalar()
+            db.session.rollback()
+            child = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', code], stdout=subprocess.PIPE,
+                                     text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            child.stdout.readline()
+            began = time.perf_counter()
+            time.sleep(random.uniform(0.5, 1.5))
+            child.send_signal(signal.SIGTERM)
+            report = child.stdout.readline()
+            elapsed = time.perf_counter() - began
+            if child.wait() != 0 or not report:
+                raise SystemExit('FAILED: the worker exited with status {} without reporting its views'.format(
+                    child.returncode))
+            recorded = sum(json.loads(report).values())
+
+            after = db.session.query(db.func.coalesce(db.func.sum(ViewCount.views), 0)).filter(pair).scalar()
+            db.session.rollback()
+            lost += recorded - (after - before)
+            print('{:>5} {:>12} {:>12} {:>8} {:>12.0f}'.format(
+                round + 1, recorded, after - before, recorded - (after - before), recorded / elapsed))
+        if lost:
+            raise SystemExit('FAILED: {} views lost'.format(lost))
+        print('OK: no views lost')
+    finally:
+        ViewCount.query.filter(pair).delete(synchronize_session=False)
+        db.session.commit()
+        drop_pair(artist_id, venue_id)
+
+
+BENCHMARKS = {
+    'compression': bench_compression,
+    'events': bench_events,
+    'projections': bench_projections,
+    'recurrence': bench_recurrence,
+    'tickets': bench_tickets,
+    'trending': bench_trending,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--occurrences', type=int, default=200)
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--buyers', type=int, default=300)
+    parser.add_argument('--capacity', type=int, default=200)
+    parser.add_argument('--pool', type=int, default=40)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between view count flushes')
+    args = parser.parse_args()
+
+    with app.app_context():
+        BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from metrics import CACHE_REQUESTS
+
+#----------------------------------------------------------------------------#
+# Cache backends.
+#----------------------------------------------------------------------------#
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    Bounded LRU in this process. Values are stored as-is, not copied, so
+    callers must treat them as read-only. Counters are kept apart from the
+    entries and are never evicted.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, MISSING)
+            if value is MISSING:
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters[key] = self._counters.get(key, 0) + 1
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """
+    Cache in a SQLite file, shared by every worker on the host. It stands in
+    for a networked cache with the same get/set/delete/counter/incr interface.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_every = 1.0
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, touched REAL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        row = conn.execute('SELECT value, touched FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        # A hit counts as a use, so that eviction is least recently used
+        # rather than oldest written; at most one write per entry per second
+        now = time.time()
+        if row[1] < now - self.touch_every:
+            conn.execute('UPDATE cache SET touched = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, touched) VALUES (?, ?, ?)',
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time()))
+        conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY touched DESC LIMIT -1 OFFSET ?)',
+                     (self.max_entries,))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def counter(self, key):
+        row = self._connect().execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def incr(self, key):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR IGNORE INTO counters (key, value) VALUES (?, 0)', (key,))
+            conn.execute('UPDATE counters SET value = value + 1 WHERE key = ?', (key,))
+            value = self.counter(key)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._connect().execute('SELECT count(*) FROM cache').fetchone()[0]
+
+
+def make_cache(url, max_entries):
+    """
+    'memory' for a per-process LRU, or 'sqlite:///<path>' to share entries.
+    """
+    if url == 'memory':
+        return LocalCache(max_entries)
+    if url.startswith('sqlite:///'):
+        return SqliteCache(url[len('sqlite:///'):], max_entries)
+    raise ValueError('Unknown cache storage "{}"'.format(url))
+
+#----------------------------------------------------------------------------#
+# Versioned listing cache.
+#----------------------------------------------------------------------------#
+
+class ListingCache:
+    """
+    Cache listing payloads under the generation of every kind of entity they
+    are built from. Writes bump a generation (bump('venues')), so an entry
+    built from older data is never looked up again and ages out of the LRU.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._bump_subscribers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_cache(app.config.get('CACHE_STORAGE', 'memory'),
+                                  app.config.get('CACHE_MAX_ENTRIES', 1000))
+        app.extensions['listing_cache'] = self
+
+    def generation(self, kind):
+        return self.backend.counter('generation:' + kind)
+
+    @property
+    def shared(self):
+        """
+        Whether generations live outside this process, seen by every worker.
+        """
+        return not isinstance(self.backend, LocalCache)
+
+    def bump(self, *kinds, announce=True):
+        for kind in kinds:
+            self.backend.incr('generation:' + kind)
+        if announce:
+            for callback in self._bump_subscribers:
+                callback(kinds)
+
+    def on_bump(self, callback):
+        """
+        Call callback(kinds) after every bump for a write made in this
+        process (not for bumps relayed from other workers).
+        """
+        self._bump_subscribers.append(callback)
+
+    def get_or_build(self, name, depends_on, build, key=None):
+        """
+        Return the cached payload for name, or build and store it. key tells
+        apart payloads of the same name (one per feed, say), which share its
+        hit and miss metrics.
+        """
+        key = '{}{}@{}'.format(name, '' if key is None else ':' + key,
+                               ','.join(str(self.generation(kind)) for kind in depends_on))
+        value = self.backend.get(key, MISSING)
+        if value is not MISSING:
+            self.hits += 1
+            CACHE_REQUESTS.labels(name, 'hit').inc()
+            return value
+
+        self.misses += 1
+        CACHE_REQUESTS.labels(name, 'miss').inc()
+        value = build()
+        self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+#----------------------------------------------------------------------------#
+# Template fragment cache.
+#----------------------------------------------------------------------------#
+
+class FragmentCache(Extension):
+    """
+    {% cache 'name', key, ... %}...{% endcache %} renders its body once per
+    distinct key and reuses the markup from environment.fragment_cache (a
+    LocalCache) after that. Keys must change whenever the output would, so
+    build them from ids and versions, never from anything request specific.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        backend = self.environment.fragment_cache
+        if backend is None:
+            return caller()
+
+        key = 'fragment:' + ':'.join(str(part) for part in parts)
+        value = backend.get(key)
+        if value is not None:
+            CACHE_REQUESTS.labels(parts[0], 'hit').inc()
+            return value
+
+        CACHE_REQUESTS.labels(parts[0], 'miss').inc()
+        value = Markup(caller())
+        backend.set(key, value)
+        return value
@@ -0,0 +1,257 @@
+import zlib
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#----------------------------------------------------------------------------#
+# Response compression.
+#
+# WSGI middleware that compresses response bodies with the best encoding the
+# client accepts: brotli and zstd when their packages are installed, gzip
+# always. Bodies are compressed as they are iterated, so a streamed response
+# (the .ics feeds, the sitemap index) is never held whole; the compressor
+# emits a block whenever it has one. Whether to compress is decided from
+# the headers; only for a compressible type without a Content-Length are the
+# first COMPRESSION_MIN_SIZE bytes read, and a body that ends sooner goes
+# out as it is.
+#
+# Responses that already have a Content-Encoding (snapshots, sitemap shards),
+# that are not text, or that are event streams, which must reach the client
+# one event at a time, are passed through untouched. COMPRESSION_ROUTES
+# overrides the defaults per endpoint.
+#----------------------------------------------------------------------------#
+
+# Content types worth compressing; everything else is already compressed or binary
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+# Never compressed: each event has to be sent as soon as it is written
+STREAMING = ('text/event-stream',)
+
+ENVIRON_KEY = 'fyyur.compression'
+
+
+class GzipEncoder:
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def available_encoders():
+    encoders = {'gzip': GzipEncoder}
+    if brotli is not None:
+        encoders['br'] = BrotliEncoder
+    if zstandard is not None:
+        encoders['zstd'] = ZstdEncoder
+    return encoders
+
+
+def accepted(header):
+    """
+    The codings of an Accept-Encoding header with their q-values.
+    """
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            codings[coding.strip().lower()] = quality
+    return codings
+
+
+def negotiate(header, preference):
+    """
+    The first coding in preference the client accepts, or None.
+    """
+    codings = accepted(header or '')
+    best, best_quality = None, 0.0
+    for coding in preference:
+        quality = codings.get(coding, codings.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware:
+
+    def __init__(self, wsgi_app, encodings, levels, min_size):
+        self.wsgi_app = wsgi_app
+        self.encoders = available_encoders()
+        # Server preference, restricted to what is installed
+        self.encodings = [encoding for encoding in encodings if encoding in self.encoders]
+        self.levels = levels
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not self.encodings:
+            return self.wsgi_app(environ, start_response)
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'), self.encodings)
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return written.append
+
+        app_iter = self.wsgi_app(environ, capture)
+        close = getattr(app_iter, 'close', None)
+        head, chunks = written, iter(app_iter)
+        # An app may only call start_response once its body is iterated
+        if not captured:
+            for chunk in chunks:
+                head.append(chunk)
+                break
+        status, headers, exc_info = captured
+
+        # Set by the app's after_request, before any of the body is read.
+        # Decide on the headers alone first, so that an event stream (or
+        # any other excluded type) goes out without waiting for a body
+        options = environ.get(ENVIRON_KEY, {})
+        if options is None or not self.compressible(status, headers):
+            start_response(status, headers, exc_info)
+            return ClosingIterator(self.passthrough(head, chunks), close)
+
+        min_size = options.get('min_size', self.min_size)
+        length = next((value for name, value in headers if name.lower() == 'content-length'), None)
+        if length is not None:
+            small = int(length) < min_size
+        else:
+            # No length given: read up to min_size bytes to tell a small body
+            # from a large one
+            size = sum(len(chunk) for chunk in head)
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= min_size:
+                    break
+            small = size < min_size
+        if small:
+            start_response(status, headers, exc_info)
+            return ClosingIterator(self.passthrough(head, chunks), close)
+
+        start_response(status, self.rewrite(headers, encoding), exc_info)
+        encoder = self.encoders[encoding](options.get('levels', {}).get(encoding, self.levels.get(encoding)))
+        return ClosingIterator(self.compress(encoder, head, chunks), close)
+
+    def compressible(self, status, headers):
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        values = {name.lower(): value for name, value in headers}
+        content_type = values.get('content-type', '').split(';')[0].strip().lower()
+        if 'content-encoding' in values or 'no-transform' in values.get('cache-control', ''):
+            return False
+        return content_type not in STREAMING and content_type.startswith(COMPRESSIBLE)
+
+    def rewrite(self, headers, encoding):
+        vary = []
+        rewritten = []
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == 'content-length':
+                continue
+            if lowered == 'vary':
+                vary.extend(part.strip() for part in value.split(','))
+                continue
+            if lowered == 'etag' and not value.startswith('W/'):
+                # The compressed body is another representation of the resource
+                value = 'W/' + value
+            rewritten.append((name, value))
+        if 'accept-encoding' not in (part.lower() for part in vary):
+            vary.append('Accept-Encoding')
+        rewritten.append(('Vary', ', '.join(vary)))
+        rewritten.append(('Content-Encoding', encoding))
+        return rewritten
+
+    def passthrough(self, head, chunks):
+        yield from head
+        yield from chunks
+
+    def compress(self, encoder, head, chunks):
+        for chunk in head:
+            block = encoder.compress(chunk)
+            if block:
+                yield block
+        for chunk in chunks:
+            block = encoder.compress(chunk)
+            if block:
+                yield block
+        yield encoder.finish()
+
+
+class Compression:
+    """
+    Install CompressionMiddleware around app.wsgi_app. COMPRESSION_ROUTES
+    maps an endpoint to None (never compress it) or to a dict overriding
+    min_size or the per-encoding levels.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('COMPRESSION_ENABLED', True):
+            return
+        self.routes = app.config.get('COMPRESSION_ROUTES', {})
+        self.middleware = CompressionMiddleware(
+            app.wsgi_app,
+            app.config.get('COMPRESSION_ENCODINGS', ('br', 'zstd', 'gzip')),
+            app.config.get('COMPRESSION_LEVELS', {'br': 4, 'zstd': 3, 'gzip': 6}),
+            app.config.get('COMPRESSION_MIN_SIZE', 1024))
+        app.wsgi_app = self.middleware
+        app.after_request(self.route_options)
+        app.extensions['compression'] = self
+
+    def route_options(self, response):
+        if request.endpoint in self.routes:
+            request.environ[ENVIRON_KEY] = self.routes[request.endpoint]
+        return response
@@ -0,0 +1,218 @@
+import itertools
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import deque
+from flask import Response, current_app, request
+from sqlalchemy import text
+from models import db
+
+#----------------------------------------------------------------------------#
+# Show events.
+#
+# Writes publish small events ('created', 'updated', 'deleted') after they
+# commit, and /shows/stream pushes them to browsers as server-sent events.
+# Each connection holds one thread (or greenlet) for as long as it is open,
+# so serve the stream from gevent or threaded workers, e.g.
+#
+#   gunicorn app:app --worker-class gevent --worker-connections 5000
+#
+# Events are fanned out to subscribers from a background thread, never from
+# the request that published them. With EVENTS_BACKEND = 'postgres' events go
+# through NOTIFY, and every worker relays them to its own subscribers from
+# one LISTEN connection.
+#----------------------------------------------------------------------------#
+
+logger = logging.getLogger('fyyur.events')
+
+
+class Subscription:
+    """
+    One open stream: its filter and a bounded queue of encoded events. A
+    subscriber that falls behind loses the oldest events and is told to
+    resync instead of holding memory for them.
+    """
+    __slots__ = ('venue_id', 'city', 'queue', 'lagged', 'ready')
+
+    def __init__(self, venue_id=None, city=None, queue_size=100):
+        self.venue_id = venue_id
+        self.city = city.lower() if city else None
+        self.queue = deque(maxlen=queue_size)
+        self.lagged = False
+        self.ready = threading.Event()
+
+    def wants(self, event):
+        # An event names one venue and city, or several (an artist's update
+        # concerns every venue the artist plays next)
+        if self.venue_id is not None:
+            return event.get('venue_id') == self.venue_id or self.venue_id in event.get('venue_ids', ())
+        if self.city is not None:
+            cities = [event.get('city')] + list(event.get('cities', ()))
+            return self.city in (city.lower() for city in cities if city)
+        return True
+
+    def push(self, message):
+        if len(self.queue) == self.queue.maxlen:
+            self.lagged = True
+        self.queue.append(message)
+        self.ready.set()
+
+
+class PostgresBroker:
+    """
+    Carry events between workers with NOTIFY on one channel, and deliver
+    the ones this worker hears to its hub from a background LISTEN thread.
+    """
+
+    def __init__(self, hub, channel):
+        self.hub = hub
+        self.channel = channel
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with db.engine.begin() as conn:
+            conn.execute(text('SELECT pg_notify(:channel, :payload)'),
+                         {'channel': self.channel, 'payload': json.dumps(event, default=str)})
+
+    def start(self, engine, logger):
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.listen, args=(engine, logger),
+                                               name='fyyur-events', daemon=True)
+                self.thread.start()
+
+    def listen(self, engine, logger):
+        while True:
+            conn = None
+            try:
+                # Detached, so the pool never hands this connection out again
+                fairy = engine.raw_connection()
+                fairy.detach()
+                conn = fairy.connection
+                conn.autocommit = True
+                conn.cursor().execute('LISTEN "{}"'.format(self.channel))
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.hub.dispatch(json.loads(conn.notifies.pop(0).payload))
+            except Exception:
+                logger.exception('Lost the event channel, listening again in 1s')
+                if conn is not None:
+                    conn.close()
+                time.sleep(1)
+
+
+class EventHub:
+    """
+    In-process broadcast of show events to every open stream. An event is
+    encoded once and the same string is queued for each matching subscriber.
+    """
+
+    def __init__(self, app=None):
+        self.subscribers = set()
+        self.broker = None
+        self.pending = queue.Queue()
+        self.thread = None
+        self.queue_size = 100
+        self.keepalive = 15
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.queue_size = app.config.get('EVENTS_QUEUE_SIZE', 100)
+        self.keepalive = app.config.get('EVENTS_KEEPALIVE', 15)
+        backend = app.config.get('EVENTS_BACKEND', 'memory')
+        if backend == 'postgres':
+            self.broker = PostgresBroker(self, app.config.get('EVENTS_CHANNEL', 'fyyur_shows'))
+        elif backend != 'memory':
+            raise ValueError('Unknown events backend "{}"'.format(backend))
+        app.add_url_rule('/shows/stream', 'show_stream', self.stream)
+        app.extensions['events'] = self
+
+    def subscribe(self, venue_id=None, city=None):
+        subscription = Subscription(venue_id, city, self.queue_size)
+        with self._lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, kind, **data):
+        """
+        Announce a committed change, e.g. publish('created', venue_id=1, ...).
+        """
+        event = dict(data, type=kind)
+        if self.broker is not None:
+            self.broker.publish(event)
+        else:
+            # Fanning out to thousands of streams takes a while; the writer
+            # only queues the event
+            self.pending.put(event)
+            self.start_dispatcher()
+
+    def start_dispatcher(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='fyyur-events-dispatch', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            event = self.pending.get()
+            try:
+                self.dispatch(event)
+            except Exception:
+                logger.exception('Event could not be dispatched')
+
+    def dispatch(self, event):
+        message = 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+            next(self._ids), event['type'], json.dumps(event, default=str))
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.wants(event):
+                subscription.push(message)
+
+    def events(self, subscription):
+        """
+        The text/event-stream body for one subscription; unsubscribes when
+        the client goes away.
+        """
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                if not subscription.ready.wait(self.keepalive):
+                    yield ': keepalive\n\n'
+                    continue
+                subscription.ready.clear()
+                if subscription.lagged:
+                    subscription.lagged = False
+                    subscription.queue.clear()
+                    yield 'event: resync\ndata: {}\n\n'
+                while subscription.queue:
+                    yield subscription.queue.popleft()
+        finally:
+            self.unsubscribe(subscription)
+
+    def stream(self):
+        # /shows/stream?venue_id=<id> or ?city=<city>; no filter gets everything
+        venue_id = request.args.get('venue_id', type=int)
+        city = request.args.get('city') or None
+        if self.broker is not None:
+            self.broker.start(db.engine, current_app.logger)
+
+        subscription = self.subscribe(venue_id, city)
+        return Response(self.events(subscription), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import HiddenField, StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -13,8 +13,36 @@ class ShowForm(Form):
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
+        format=['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'],
         default= datetime.today()
     )
+    recurrence = SelectField(
+        'recurrence',
+        choices=[
+            ('', 'Does not repeat'),
+            ('WEEKLY', 'Weekly'),
+            ('MONTHLY', 'Monthly'),
+        ],
+        default=''
+    )
+    recurrence_interval = IntegerField(
+        'recurrence_interval',
+        validators=[Optional(), NumberRange(min=1)],
+        default=1
+    )
+    recurrence_count = IntegerField(
+        'recurrence_count',
+        validators=[Optional(), NumberRange(min=1)]
+    )
+    recurrence_until = DateTimeField(
+        'recurrence_until',
+        validators=[Optional()],
+        format=['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+    )
+    capacity = IntegerField(
+        'capacity',
+        validators=[Optional(), NumberRange(min=1, max=100000)]
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -127,6 +155,9 @@ class VenueForm(Form):
         'seeking_description'
     )
 
+    # Row version the edit form was rendered from, for optimistic concurrency
+    version = HiddenField( 'version' )
+
 
 
 class ArtistForm(Form):
@@ -238,3 +269,6 @@ class ArtistForm(Form):
             'seeking_description'
      )
 
+    # Row version the edit form was rendered from, for optimistic concurrency
+    version = HiddenField( 'version' )
+
@@ -0,0 +1,15 @@
+# gunicorn settings for Fyyur: gunicorn app:app
+from metrics import child_exit
+
+
+def on_starting(server):
+    # Imported here: a module-level name "config" would be read as a setting
+    import config
+
+    # Generations kept per worker and announced to nobody: every other worker
+    # would keep serving the listings from before a write
+    if server.cfg.workers > 1 and config.CACHE_STORAGE == 'memory' and config.INVALIDATION_TRANSPORT == 'memory':
+        raise RuntimeError(
+            'With {} workers, set CACHE_STORAGE to a shared backend or INVALIDATION_TRANSPORT to "postgres" '
+            '(FYYUR_CACHE_STORAGE, FYYUR_INVALIDATION_TRANSPORT); with both "memory" each worker would serve '
+            'stale listings after another one writes.'.format(server.cfg.workers))
@@ -0,0 +1,90 @@
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# iCalendar feeds (RFC 5545).
+#
+# Feeds are written line by line straight from a streamed query, so a feed
+# with thousands of shows never sits in memory as a whole. start_time is
+# stored in UTC, as everywhere else in Fyyur.
+#----------------------------------------------------------------------------#
+
+def escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line):
+    """
+    Split a content line into 75-octet pieces joined by CRLF and a space,
+    without cutting a UTF-8 character in two.
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    pieces, start = [], 0
+    while start < len(encoded):
+        end = min(start + (75 if not pieces else 74), len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        pieces.append(encoded[start:end].decode('utf-8'))
+        start = end
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def utc(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def feed_rows(*criteria):
+    """
+    Every show matching criteria with its artist and venue, in one joined
+    query read in batches.
+    """
+    return db.session.query(
+        Show.id, Show.start_time, Show.venue_id,
+        Venue.name.label('venue_name'), Venue.address, Venue.city, Venue.state,
+        Artist.name.label('artist_name')).join(Venue, Show.venue_id == Venue.id).join(
+        Artist, Show.artist_id == Artist.id).filter(*criteria).order_by(
+        Show.start_time, Show.id).yield_per(500)
+
+
+def feed_version(*criteria):
+    """
+    A digest of everything the feed shows: which shows match (shows are
+    never edited, only added and deleted or archived) and when their venues
+    and artists last changed. One aggregate query over the feed's join.
+    """
+    row = db.session.query(
+        func.count(Show.id), func.max(Show.id), func.sum(Show.id),
+        func.max(Venue.updated_at), func.max(Artist.updated_at)).join(
+        Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id).filter(*criteria).one()
+    return hashlib.sha1(repr(tuple(row)).encode()).hexdigest()[:16]
+
+
+def calendar(name, rows, base_url, hours=2):
+    """
+    Yield the feed as text: one VEVENT per show, each lasting `hours`.
+    """
+    duration = timedelta(hours=hours)
+    stamp = utc(datetime.utcnow())
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:-//Fyyur//Shows//EN')
+    yield fold('CALSCALE:GREGORIAN')
+    yield fold('X-WR-CALNAME:' + escape(name))
+    for row in rows:
+        location = ', '.join(part for part in (row.venue_name, row.address, row.city, row.state) if part)
+        yield ''.join([
+            fold('BEGIN:VEVENT'),
+            fold('UID:show-{}@fyyur'.format(row.id)),
+            fold('DTSTAMP:' + stamp),
+            fold('DTSTART:' + utc(row.start_time)),
+            fold('DTEND:' + utc(row.start_time + duration)),
+            fold('SUMMARY:' + escape('{} at {}'.format(row.artist_name, row.venue_name))),
+            fold('LOCATION:' + escape(location)),
+            fold('URL:{}venues/{}'.format(base_url, row.venue_id)),
+            fold('END:VEVENT'),
+        ])
+    yield fold('END:VCALENDAR')
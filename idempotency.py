@@ -0,0 +1,193 @@
+import hashlib
+import json
+import re
+import uuid
+from datetime import datetime, timedelta
+import click
+from flask import Response, flash, g, request, session
+from flask.cli import AppGroup
+from markupsafe import Markup
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from werkzeug.exceptions import BadRequest, Conflict, UnprocessableEntity
+from models import db
+
+#----------------------------------------------------------------------------#
+# Idempotency keys.
+#
+# A POST to one of IDEMPOTENT_ENDPOINTS may carry a key, in an
+# Idempotency-Key header or in the idempotency_key field that the create
+# forms render. The first request with a key inserts its row on a
+# connection of its own and keeps that transaction open while the view
+# runs, then stores the response in the row and commits. A duplicate that
+# arrives meanwhile blocks on the row's primary key until the first one
+# finishes; it then replays the stored response (status, Location, body and
+# flashed messages) without running the view. If the first request fails
+# its row is rolled back and the duplicate runs the view in its place. The
+# create views catch their errors and redirect back to the form, so they
+# call failed() to say so; the status code alone does not tell.
+#
+# Keys expire after IDEMPOTENCY_TTL seconds. An expired row is taken over by
+# the next request with its key, and `flask idempotency purge` deletes them.
+#----------------------------------------------------------------------------#
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+KEY = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+# Form fields that differ between two submissions of the same form
+IGNORED_FIELDS = ('csrf_token', FIELD)
+
+# Responses to retry rather than replay
+RETRYABLE = (429,)
+
+CLAIM = text(
+    'INSERT INTO "IdempotencyKey" (key, fingerprint, created_at, expires_at) '
+    'VALUES (:key, :fingerprint, :now, :expires_at) '
+    'ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, created_at = excluded.created_at, '
+    'expires_at = excluded.expires_at, status = NULL, headers = NULL, body = NULL, flashes = NULL '
+    'WHERE "IdempotencyKey".expires_at < :now '
+    'RETURNING key')
+
+STORED = text('SELECT fingerprint, status, headers, body, flashes FROM "IdempotencyKey" WHERE key = :key')
+
+STORE = text(
+    'UPDATE "IdempotencyKey" SET status = :status, headers = :headers, body = :body, flashes = :flashes '
+    'WHERE key = :key')
+
+PURGE = text(
+    'DELETE FROM "IdempotencyKey" WHERE key IN ('
+    '  SELECT key FROM "IdempotencyKey" WHERE expires_at < :now LIMIT :batch)')
+
+
+def fingerprint():
+    """
+    What the request asks for, so that a key reused for something else is
+    refused rather than answered with another request's response.
+    """
+    digest = hashlib.sha256(request.endpoint.encode())
+    for name, value in sorted(request.form.items(multi=True)):
+        if name not in IGNORED_FIELDS:
+            digest.update('\0{}\0{}'.format(name, value).encode())
+    return digest.hexdigest()
+
+
+class Idempotency:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.endpoints = set(app.config.get('IDEMPOTENT_ENDPOINTS', ()))
+        self.ttl = app.config.get('IDEMPOTENCY_TTL', 86400)
+        self.wait = app.config.get('IDEMPOTENCY_WAIT', 30)
+        app.before_request(self.claim)
+        app.after_request(self.store)
+        app.teardown_request(self.release)
+        app.jinja_env.globals['idempotency_field'] = self.field
+        app.cli.add_command(idempotency_cli)
+        app.extensions['idempotency'] = self
+
+    def field(self):
+        """
+        A hidden input with a fresh key, for the forms of the endpoints.
+        """
+        return Markup('<input type="hidden" name="{}" value="{}">'.format(FIELD, uuid.uuid4().hex))
+
+    def failed(self):
+        """
+        Called by a view that handled its own failure, so that its response
+        is not stored and a retry with the same key runs the view again.
+        """
+        g.idempotency_failed = True
+
+    def claim(self):
+        if request.method != 'POST' or request.endpoint not in self.endpoints:
+            return
+        key = request.headers.get(HEADER) or request.form.get(FIELD)
+        if not key:
+            return
+        if not KEY.match(key):
+            raise BadRequest('{} must be 8 to 64 letters, digits, "-" or "_".'.format(HEADER))
+
+        now = datetime.utcnow()
+        conn = db.engine.connect()
+        transaction = conn.begin()
+        try:
+            # Waits here while another request holds the key
+            conn.execute(text("SET LOCAL lock_timeout = '{}s'".format(self.wait)))
+            claimed = conn.execute(CLAIM, {'key': key, 'fingerprint': fingerprint(), 'now': now,
+                                           'expires_at': now + timedelta(seconds=self.ttl)}).first()
+            stored = None if claimed else conn.execute(STORED, {'key': key}).one()
+        except Exception as e:
+            transaction.rollback()
+            conn.close()
+            # lock_not_available: the first request outlasted IDEMPOTENCY_WAIT
+            if isinstance(e, OperationalError) and getattr(e.orig, 'pgcode', None) == '55P03':
+                raise Conflict('A request with this {} is still being processed.'.format(HEADER))
+            raise
+
+        if claimed:
+            g.idempotency = (key, conn, transaction)
+            return
+        transaction.rollback()
+        conn.close()
+        if stored.fingerprint != fingerprint():
+            raise UnprocessableEntity('This {} was already used for a different request.'.format(HEADER))
+        return self.replay(stored)
+
+    def replay(self, stored):
+        for category, message in stored.flashes or ():
+            flash(message, category)
+        response = Response(stored.body, status=stored.status, headers=stored.headers)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def store(self, response):
+        claimed = g.pop('idempotency', None)
+        failed = g.pop('idempotency_failed', False)
+        if claimed is None:
+            return response
+        key, conn, transaction = claimed
+        try:
+            if failed or response.status_code >= 500 or response.status_code in RETRYABLE:
+                transaction.rollback()
+            else:
+                headers = {name: value for name, value in response.headers.items()
+                           if name in ('Content-Type', 'Location')}
+                conn.execute(STORE, {'key': key, 'status': response.status_code, 'headers': json.dumps(headers),
+                                     'body': response.get_data(), 'flashes': json.dumps(session.get('_flashes', []))})
+                transaction.commit()
+        finally:
+            conn.close()
+        return response
+
+    def release(self, exc=None):
+        # The view raised, so after_request never stored a response
+        claimed = g.pop('idempotency', None)
+        if claimed is not None:
+            key, conn, transaction = claimed
+            transaction.rollback()
+            conn.close()
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+idempotency_cli = AppGroup('idempotency', help='Maintain stored idempotency keys.')
+
+
+@idempotency_cli.command('purge')
+@click.option('--batch', default=1000, help='Rows deleted per transaction.')
+def purge_command(batch):
+    """Delete expired idempotency keys; run daily from cron."""
+    deleted, now = 0, datetime.utcnow()
+    while True:
+        with db.engine.begin() as conn:
+            count = conn.execute(PURGE, {'now': now, 'batch': batch}).rowcount
+        deleted += count
+        if count < batch:
+            break
+    click.echo('Deleted {} expired key(s)'.format(deleted))
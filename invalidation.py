@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from events import PostgresBroker
+from metrics import INVALIDATION_DELAY
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Invalidation bus.
+#
+# Every commit that touched a venue, artist or show is announced as a list of
+# (kind, id, action) changes. The committing worker applies it at once, then
+# hands it to a transport; every other worker applies it when it arrives,
+# which for the listing cache means bumping the generations built from that
+# kind, so entries built from the old rows are never read again.
+#
+# ORM writes are picked up from the flush. Bulk and Core statements are not
+# seen by the ORM, so their callers use record() before committing.
+#----------------------------------------------------------------------------#
+
+KINDS = {Venue: 'venue', Artist: 'artist', Show: 'show'}
+
+# Listing cache generations built from each kind of entity
+LISTINGS = {
+    'venue': ('venues',),
+    'artist': ('artists',),
+    'show': ('shows',),
+}
+
+# pg_notify refuses payloads of 8000 bytes or more
+MAX_MESSAGE_BYTES = 7000
+
+
+def record(session, kind, entity_id, action):
+    """
+    Announce a change made outside the ORM when session next commits.
+    """
+    session.info.setdefault('invalidations', set()).add((kind, entity_id, action))
+
+
+def listings(changes):
+    kinds = set()
+    for kind, entity_id, action in changes:
+        kinds.update(LISTINGS[kind])
+        # Shows cascade with their venue or artist
+        if action == 'deleted' and kind in ('venue', 'artist'):
+            kinds.add('shows')
+    return kinds
+
+
+class MemoryTransport:
+    """
+    A single process has nobody else to tell.
+    """
+
+    def publish(self, message):
+        pass
+
+    def start(self, engine, logger):
+        pass
+
+
+class FileTransport:
+    """
+    Append messages as JSON lines to a file that every worker on the host
+    tails. A stand-in for a real broker in tests and on a single host; the
+    file is never truncated.
+    """
+
+    def __init__(self, bus, path, interval=0.05):
+        self.bus = bus
+        self.path = path
+        self.interval = interval
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(message) + '\n')
+
+    def start(self, engine, logger):
+        with self._lock:
+            if self.thread is None:
+                # Only messages written from now on concern this worker
+                open(self.path, 'a').close()
+                offset = os.path.getsize(self.path)
+                self.thread = threading.Thread(target=self.tail, args=(offset, logger),
+                                               name='fyyur-invalidation', daemon=True)
+                self.thread.start()
+
+    def tail(self, offset, logger):
+        with open(self.path) as f:
+            f.seek(offset)
+            partial = ''
+            while True:
+                line = f.readline()
+                if not line:
+                    time.sleep(self.interval)
+                    continue
+                partial += line
+                if not partial.endswith('\n'):
+                    continue
+                try:
+                    self.bus.dispatch(json.loads(partial))
+                except Exception:
+                    logger.exception('Invalidation message could not be applied')
+                partial = ''
+
+
+class InvalidationBus:
+
+    def __init__(self, app=None, listing_cache=None):
+        self.origin = uuid.uuid4().hex
+        self.transport = None
+        self.received = 0
+        if app is not None:
+            self.init_app(app, listing_cache)
+
+    def init_app(self, app, listing_cache):
+        self.app = app
+        self.listing_cache = listing_cache
+        url = app.config.get('INVALIDATION_TRANSPORT', 'memory')
+        if url == 'memory':
+            self.transport = MemoryTransport()
+        elif url == 'postgres':
+            self.transport = PostgresBroker(self, app.config.get('INVALIDATION_CHANNEL', 'fyyur_invalidation'))
+        elif url.startswith('file:///'):
+            self.transport = FileTransport(self, url[len('file://'):])
+        else:
+            raise ValueError('Unknown invalidation transport "{}"'.format(url))
+
+        event.listen(Session, 'after_flush', self.collect)
+        event.listen(Session, 'after_commit', self.commit)
+        event.listen(Session, 'after_soft_rollback', self.discard)
+        app.before_request(self.start)
+        app.extensions['invalidation'] = self
+
+    def start(self):
+        self.transport.start(db.engine, self.app.logger)
+
+    def collect(self, session, flush_context):
+        changes = session.info.setdefault('invalidations', set())
+        for objects, action in ((session.new, 'created'), (session.dirty, 'updated'), (session.deleted, 'deleted')):
+            for obj in objects:
+                kind = KINDS.get(type(obj))
+                if kind and (action != 'updated' or session.is_modified(obj)):
+                    changes.add((kind, obj.id, action))
+
+    def discard(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop('invalidations', None)
+
+    def commit(self, session):
+        changes = session.info.pop('invalidations', None)
+        if not changes:
+            return
+        self.listing_cache.bump(*listings(changes))
+        message = {'origin': self.origin, 'sent': time.time(), 'changes': sorted(changes, key=str)}
+        if len(json.dumps(message)) > MAX_MESSAGE_BYTES:
+            # Too many ids for one notification: name the kinds only
+            message['changes'] = sorted({(kind, None, action) for kind, entity_id, action in changes}, key=str)
+        try:
+            self.transport.publish(message)
+        except Exception:
+            self.app.logger.exception('Invalidation could not be published')
+
+    def dispatch(self, message):
+        """
+        Apply a message from the transport; our own were applied at commit.
+        """
+        if message['origin'] == self.origin:
+            return
+        self.received += 1
+        INVALIDATION_DELAY.observe(max(0.0, time.time() - message['sent']))
+        # A shared cache backend already saw the bump made by the origin
+        if not self.listing_cache.shared:
+            self.listing_cache.bump(*listings(message['changes']), announce=False)
@@ -0,0 +1,396 @@
+"""
+HTTP load test for Fyyur.
+
+Starts the app under gunicorn against the database in config.py (optionally
+seeding it first), replays a weighted mix of the app's routes - including
+the venue and artist create and edit forms with their CSRF tokens - and reports
+throughput, latency percentiles, error rates and DB pool use over time.
+
+  python loadtest.py --seed --workers 4 --users 32 --duration 60
+  python loadtest.py --rate 200 --duration 30
+  python loadtest.py --url http://127.0.0.1:5000 --users 8
+
+--users runs a closed loop: each virtual user sends its next request as soon
+as the previous one returns. --rate runs an open loop at a fixed arrival
+rate; latency is measured from the scheduled start, so a backed-up server
+is not hidden by the client slowing down.
+
+Every virtual user comes from 127.0.0.1, so the gunicorn it starts runs with
+RATELIMITS and load shedding off (FYYUR_RATELIMIT_ENABLED=0,
+FYYUR_LOADSHED_MAX_INFLIGHT=0); --keep-limits leaves them on to measure the
+limiter itself. A server given with --url runs with whatever it was started
+with.
+"""
+import argparse
+import http.client
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+#----------------------------------------------------------------------------#
+# Seeding.
+#----------------------------------------------------------------------------#
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Folk', 'Funk', 'Jazz', 'Pop', 'Punk', 'Rock n Roll', 'Soul']
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'), ('Chicago', 'IL')]
+
+
+def seed(venues, artists, shows):
+    """
+    Fill the configured database with generated venues, artists and shows.
+    """
+    from app import app
+    from models import db, Venue, Artist, Show
+
+    with app.app_context():
+        rows = []
+        for i in range(venues):
+            city, state = random.choice(CITIES)
+            rows.append({'name': 'Load Venue {}'.format(i), 'city': city, 'state': state,
+                         'address': '{} Main St'.format(i), 'genres': random.sample(GENRES, 2),
+                         'seeking_talent': random.random() < 0.3})
+        for chunk in range(0, len(rows), 1000):
+            db.session.execute(Venue.__table__.insert().values(rows[chunk:chunk + 1000]))
+
+        rows = []
+        for i in range(artists):
+            city, state = random.choice(CITIES)
+            rows.append({'name': 'Load Artist {}'.format(i), 'city': city, 'state': state,
+                         'genres': random.sample(GENRES, 2), 'seeking_venue': random.random() < 0.3})
+        for chunk in range(0, len(rows), 1000):
+            db.session.execute(Artist.__table__.insert().values(rows[chunk:chunk + 1000]))
+        db.session.commit()
+
+        venue_ids = [id for id, in db.session.query(Venue.id)]
+        artist_ids = [id for id, in db.session.query(Artist.id)]
+        now = datetime.utcnow().replace(microsecond=0)
+        rows = [{'venue_id': random.choice(venue_ids), 'artist_id': random.choice(artist_ids),
+                 'start_time': now + timedelta(hours=random.randint(-24 * 365, 24 * 180))}
+                for _ in range(shows)]
+        for chunk in range(0, len(rows), 1000):
+            db.session.execute(Show.__table__.insert().values(rows[chunk:chunk + 1000]))
+        db.session.commit()
+
+
+def sample_ids():
+    from app import app
+    from models import db, Venue, Artist
+
+    with app.app_context():
+        venue_ids = [id for id, in db.session.query(Venue.id).limit(1000)]
+        artist_ids = [id for id, in db.session.query(Artist.id).limit(1000)]
+    if not venue_ids or not artist_ids:
+        sys.exit('The database has no venues or artists; run with --seed.')
+    return venue_ids, artist_ids
+
+#----------------------------------------------------------------------------#
+# Virtual users.
+#----------------------------------------------------------------------------#
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+FORM_VERSION = re.compile(r'name="version"[^>]*value="([^"]+)"')
+
+
+class Client:
+    """
+    One keep-alive connection with its own session cookie, like a browser tab.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.cookie = None
+        self.conn = None
+
+    def request(self, method, path, form=None):
+        body, headers = None, {}
+        if form is not None:
+            body = urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; retry once on a fresh one
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, data
+
+    def submit(self, form_path, post_path, fields):
+        """
+        GET a form, pick up its CSRF token (and the row version of an edit
+        form), and POST it back.
+        """
+        status, page = self.request('GET', form_path)
+        if status >= 400:
+            return status, page
+        page = page.decode('utf-8', 'replace')
+        for name, pattern in (('csrf_token', CSRF_TOKEN), ('version', FORM_VERSION)):
+            match = pattern.search(page)
+            if match:
+                fields = dict(fields, **{name: match.group(1)})
+        return self.request('POST', post_path, fields)
+
+
+def scenarios(venue_ids, artist_ids):
+    """
+    (name, weight, action) for each kind of request in the mix.
+    """
+    def new_venue(client):
+        city, state = random.choice(CITIES)
+        return client.submit('/venues/create', '/venues/create', {
+            'name': 'Load Venue {}'.format(random.getrandbits(32)), 'city': city, 'state': state,
+            'address': '1 Test St', 'genres': random.sample(GENRES, 2), 'facebook_link': 'https://facebook.com/x'})
+
+    def new_artist(client):
+        city, state = random.choice(CITIES)
+        return client.submit('/artists/create', '/artists/create', {
+            'name': 'Load Artist {}'.format(random.getrandbits(32)), 'city': city, 'state': state,
+            'genres': random.sample(GENRES, 2), 'facebook_link': 'https://facebook.com/x'})
+
+    def edit_venue(client):
+        venue_id = random.choice(venue_ids)
+        city, state = random.choice(CITIES)
+        return client.submit('/venues/{}/edit'.format(venue_id), '/venues/{}/edit'.format(venue_id), {
+            'name': 'Load Venue {}'.format(venue_id), 'city': city, 'state': state, 'address': '1 Test St',
+            'genres': random.sample(GENRES, 2), 'seeking_talent': 'y', 'facebook_link': 'https://facebook.com/x'})
+
+    def edit_artist(client):
+        artist_id = random.choice(artist_ids)
+        city, state = random.choice(CITIES)
+        return client.submit('/artists/{}/edit'.format(artist_id), '/artists/{}/edit'.format(artist_id), {
+            'name': 'Load Artist {}'.format(artist_id), 'city': city, 'state': state,
+            'genres': random.sample(GENRES, 2), 'seeking_venue': 'y', 'facebook_link': 'https://facebook.com/x'})
+
+    return [
+        ('home', 5, lambda c: c.request('GET', '/')),
+        ('venues', 15, lambda c: c.request('GET', '/venues')),
+        ('artists', 10, lambda c: c.request('GET', '/artists')),
+        ('shows', 15, lambda c: c.request('GET', '/shows')),
+        ('venue', 20, lambda c: c.request('GET', '/venues/{}'.format(random.choice(venue_ids)))),
+        ('artist', 20, lambda c: c.request('GET', '/artists/{}'.format(random.choice(artist_ids)))),
+        ('search venues', 5, lambda c: c.request('POST', '/venues/search', {'search_term': random.choice(['Load', 'Venue 1', 'hop'])})),
+        ('search artists', 5, lambda c: c.request('POST', '/artists/search', {'search_term': random.choice(['Load', 'Artist 2', 'band'])})),
+        ('create venue', 2, new_venue),
+        ('create artist', 2, new_artist),
+        ('edit venue', 2, edit_venue),
+        ('edit artist', 2, edit_artist),
+    ]
+
+#----------------------------------------------------------------------------#
+# Recording and reporting.
+#----------------------------------------------------------------------------#
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def record(self, name, status, latency):
+        with self.lock:
+            self.samples.append((time.monotonic(), name, status, latency))
+
+    def drain(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+
+def scrape_pool(client):
+    """
+    Connections checked out across all workers, read from /metrics.
+    """
+    try:
+        status, body = client.request('GET', '/metrics')
+    except Exception:
+        return None
+    match = re.search(rb'^fyyur_db_pool_checked_out(?:\{[^}]*\})? ([0-9.e+-]+)$', body, re.M)
+    return float(match.group(1)) if match else None
+
+
+def summarize(samples, elapsed):
+    latencies = [s[3] for s in samples]
+    errors = sum(1 for s in samples if s[2] is None or s[2] >= 400)
+    return {
+        'count': len(samples),
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'errors': errors / len(samples) * 100 if samples else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': max(latencies, default=0.0) * 1000,
+    }
+
+#----------------------------------------------------------------------------#
+# Load generation.
+#----------------------------------------------------------------------------#
+
+def run_action(client, mix, weights, recorder, scheduled=None):
+    name, _, action = random.choices(mix, weights)[0]
+    started = time.perf_counter() if scheduled is None else scheduled
+    try:
+        status, _ = action(client)
+    except Exception:
+        status = None
+    recorder.record(name, status, time.perf_counter() - started)
+
+
+def closed_loop(args, mix, recorder, stop):
+    weights = [w for _, w, _ in mix]
+
+    def user():
+        client = Client(args.url)
+        while not stop.is_set():
+            run_action(client, mix, weights, recorder)
+            if args.think:
+                time.sleep(random.expovariate(1 / args.think))
+
+    return [threading.Thread(target=user, daemon=True) for _ in range(args.users)]
+
+
+def open_loop(args, mix, recorder, stop):
+    weights = [w for _, w, _ in mix]
+    arrivals = queue.Queue()
+
+    def scheduler():
+        interval, next_at = 1.0 / args.rate, time.perf_counter()
+        while not stop.is_set():
+            now = time.perf_counter()
+            while next_at <= now:
+                arrivals.put(next_at)
+                next_at += interval
+            time.sleep(min(interval, 0.01))
+
+    def sender():
+        client = Client(args.url)
+        while not stop.is_set():
+            try:
+                scheduled = arrivals.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            run_action(client, mix, weights, recorder, scheduled)
+
+    return [threading.Thread(target=scheduler, daemon=True)] + \
+        [threading.Thread(target=sender, daemon=True) for _ in range(args.users)]
+
+
+def start_server(args):
+    """
+    Run the app under gunicorn with file-backed metrics so /metrics covers
+    every worker, and invalidations over NOTIFY unless the environment says
+    otherwise.
+    """
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix='fyyur-metrics-'))
+    # Workers share writes through the database the run already uses
+    env.setdefault('FYYUR_INVALIDATION_TRANSPORT', 'postgres')
+    if not args.keep_limits:
+        env.update(FYYUR_RATELIMIT_ENABLED='0', FYYUR_LOADSHED_MAX_INFLIGHT='0')
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', '127.0.0.1:{}'.format(args.port),
+               '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning']
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            Client(args.url, timeout=1).request('GET', '/')
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit('gunicorn did not come up on port {}'.format(args.port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='target an already running server instead of starting gunicorn')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--seed', action='store_true', help='insert generated data before the run')
+    parser.add_argument('--keep-limits', action='store_true', help='leave rate limits and load shedding on')
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=16, help='virtual users (closed loop) or senders (open loop)')
+    parser.add_argument('--rate', type=float, help='fixed arrival rate in requests per second')
+    parser.add_argument('--think', type=float, default=0.0, help='mean think time between requests, in seconds')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between progress lines')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.venues, args.artists, args.shows)
+    mix = scenarios(*sample_ids())
+
+    server = None
+    if not args.url:
+        args.url = 'http://127.0.0.1:{}'.format(args.port)
+        server = start_server(args)
+
+    recorder, stop = Recorder(), threading.Event()
+    threads = (open_loop if args.rate else closed_loop)(args, mix, recorder, stop)
+    probe = Client(args.url)
+    samples = []
+    try:
+        print('{:>6} {:>9} {:>8} {:>8} {:>8} {:>7} {:>6}'.format('t', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'err %', 'pool'))
+        began = time.monotonic()
+        for thread in threads:
+            thread.start()
+        while time.monotonic() - began < args.duration:
+            time.sleep(args.interval)
+            window = recorder.drain()
+            samples.extend(window)
+            stats = summarize(window, args.interval)
+            pool = scrape_pool(probe)
+            print('{:>6.0f} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.2f} {:>6}'.format(
+                time.monotonic() - began, stats['rps'], stats['p50'], stats['p95'], stats['p99'],
+                stats['errors'], '-' if pool is None else int(pool)))
+        stop.set()
+        elapsed = time.monotonic() - began
+        samples.extend(recorder.drain())
+    finally:
+        stop.set()
+        if server:
+            server.terminate()
+            server.wait()
+
+    print()
+    print('{:<16} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'route', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'err %'))
+    for name in [name for name, _, _ in mix] + ['total']:
+        subset = samples if name == 'total' else [s for s in samples if s[1] == name]
+        stats = summarize(subset, elapsed)
+        print('{:<16} {:>7} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.2f}'.format(
+            name, stats['count'], stats['rps'], stats['p50'], stats['p95'], stats['p99'], stats['max'], stats['errors']))
+
+
+if __name__ == '__main__':
+    main()
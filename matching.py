@@ -0,0 +1,106 @@
+from flask import current_app
+from sqlalchemy import case, func, select, union
+from models import db, Venue, Artist, VenueGenre, ArtistGenre
+
+#----------------------------------------------------------------------------#
+# Artist / venue matching.
+#----------------------------------------------------------------------------#
+
+# Attributes whose change means an entity's index rows must be rebuilt
+INDEXED_ATTRIBUTES = {'genres', 'city', 'state', 'seeking_talent', 'seeking_venue'}
+
+
+def index_venue(venue):
+    """
+    Replace the venue's rows in the genre index, in the current transaction.
+    """
+    VenueGenre.query.filter(VenueGenre.venue_id == venue.id).delete(synchronize_session=False)
+    if venue.seeking_talent and venue.genres:
+        db.session.execute(VenueGenre.__table__.insert().values([
+            {'genre': genre, 'venue_id': venue.id, 'city': venue.city, 'state': venue.state}
+            for genre in set(venue.genres)
+        ]))
+
+
+def index_artist(artist):
+    """
+    Replace the artist's rows in the genre index, in the current transaction.
+    """
+    ArtistGenre.query.filter(ArtistGenre.artist_id == artist.id).delete(synchronize_session=False)
+    if artist.seeking_venue and artist.genres:
+        db.session.execute(ArtistGenre.__table__.insert().values([
+            {'genre': genre, 'artist_id': artist.id, 'city': artist.city, 'state': artist.state}
+            for genre in set(artist.genres)
+        ]))
+
+
+def candidates(index, id_column, genres, city, state, limit, per_genre):
+    """
+    The ids worth ranking, instead of every index row of the genres. In the
+    entity's state the choice is exact: overlap is counted over all of the
+    state's rows of the genres (a range of the (genre, state, id) index) and
+    the best `limit` are kept, so an entity sharing more genres always makes
+    the cut. Elsewhere it is an approximation: the per_genre most recently
+    listed ids of each genre, read backwards along the primary key.
+    """
+    overlap = func.count()
+    same_city = func.max(case((index.city == city, 1), else_=0))
+    parts = [select(id_column).where(index.genre.in_(set(genres)), index.state == state).group_by(
+        id_column).order_by(overlap.desc(), same_city.desc(), id_column).limit(limit)]
+    for genre in set(genres):
+        parts.append(select(id_column).where(index.genre == genre).order_by(id_column.desc()).limit(per_genre))
+    return union(*parts)
+
+
+def ranked(index, id_column, genres, city, state, limit=20, per_genre=200):
+    """
+    Ids from the index sharing at least one genre, best first: most genres
+    in common, then same city and state, then same state. Only the
+    candidates() are ranked, with their overlap counted in full.
+    """
+    if not genres:
+        return []
+
+    overlap = func.count().label('overlap')
+    same_city = func.max(case(((index.city == city) & (index.state == state), 1), else_=0)).label('same_city')
+    same_state = func.max(case((index.state == state, 1), else_=0)).label('same_state')
+    ids = candidates(index, id_column, genres, city, state, limit, per_genre).subquery()
+
+    return db.session.query(id_column, overlap, same_city, same_state).filter(
+        index.genre.in_(set(genres)), id_column.in_(select(ids.c[0]))).group_by(id_column).order_by(
+        overlap.desc(), same_city.desc(), same_state.desc(), id_column).limit(limit).all()
+
+
+def with_names(model, rows):
+    """
+    Attach id, name, city, state and image to ranked rows with one query.
+    """
+    ids = [row[0] for row in rows]
+    entities = {
+        entity.id: entity for entity in db.session.query(
+            model.id, model.name, model.city, model.state, model.image_link).filter(model.id.in_(ids))
+    }
+    return [
+        {
+            'id': row[0],
+            'name': entities[row[0]].name,
+            'city': entities[row[0]].city,
+            'state': entities[row[0]].state,
+            'image_link': entities[row[0]].image_link,
+            'overlap': row.overlap,
+            'same_city': bool(row.same_city),
+        }
+        for row in rows if row[0] in entities
+    ]
+
+
+def venues_for_artist(artist, limit=20):
+    rows = ranked(VenueGenre, VenueGenre.venue_id, artist.genres, artist.city, artist.state, limit=limit,
+                  per_genre=current_app.config.get('MATCH_CANDIDATES_PER_GENRE', 200))
+    return with_names(Venue, rows)
+
+
+def artists_for_venue(venue, limit=20):
+    rows = ranked(ArtistGenre, ArtistGenre.artist_id, venue.genres, venue.city, venue.state, limit=limit,
+                  per_genre=current_app.config.get('MATCH_CANDIDATES_PER_GENRE', 200))
+    return with_names(Artist, rows)
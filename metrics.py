@@ -0,0 +1,102 @@
+import os
+import time
+from flask import Response
+from jinja2 import Template
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#
+# Under several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory
+# before the app starts. Each worker then records into its own mmap'd file and
+# /metrics sums them up. Call child_exit() from gunicorn's child_exit hook.
+#----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter(
+    'fyyur_requests_total', 'Requests handled', ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram(
+    'fyyur_request_duration_seconds', 'Request latency', ['route'], buckets=LATENCY_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    'fyyur_request_db_seconds', 'Time spent in SQL per request', ['route'], buckets=LATENCY_BUCKETS)
+REQUEST_DB_QUERIES = Histogram(
+    'fyyur_request_db_queries', 'SQL statements per request', ['route'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+QUERY_LATENCY = Histogram(
+    'fyyur_db_query_duration_seconds', 'SQL statement latency', buckets=LATENCY_BUCKETS)
+TEMPLATE_RENDER = Histogram(
+    'fyyur_template_render_seconds', 'Jinja render time', ['template'], buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS = Counter(
+    'fyyur_cache_requests_total', 'Listing cache lookups', ['name', 'result'])
+INVALIDATION_DELAY = Histogram(
+    'fyyur_invalidation_delay_seconds', 'Time from a commit to its invalidation reaching another worker',
+    buckets=LATENCY_BUCKETS)
+POOL_CHECKED_OUT = Gauge(
+    'fyyur_db_pool_checked_out', 'Connections checked out of the pool', multiprocess_mode='livesum')
+POOL_CONNECTIONS = Gauge(
+    'fyyur_db_pool_connections', 'Connections open in the pool', multiprocess_mode='livesum')
+
+
+class TimedTemplate(Template):
+    """
+    Template that records how long a top-level render takes.
+    """
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER.labels(self.name or '-').observe(time.perf_counter() - started)
+
+
+def child_exit(server, worker):
+    """
+    gunicorn hook: drop the live gauges of a worker that went away.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class Metrics:
+    """
+    Record request, SQL, pool and template metrics and serve them at
+    /metrics in the Prometheus text format.
+    """
+
+    def __init__(self, app=None, telemetry=None):
+        if app is not None:
+            self.init_app(app, telemetry)
+
+    def init_app(self, app, telemetry):
+        telemetry.on_request(self.observe_request)
+        telemetry.on_query(self.observe_query)
+        event.listen(Pool, 'connect', lambda *args: POOL_CONNECTIONS.inc())
+        event.listen(Pool, 'close', lambda *args: POOL_CONNECTIONS.dec())
+        event.listen(Pool, 'checkout', lambda *args: POOL_CHECKED_OUT.inc())
+        event.listen(Pool, 'checkin', lambda *args: POOL_CHECKED_OUT.dec())
+        app.jinja_env.template_class = TimedTemplate
+        app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', self.export)
+
+    def observe_request(self, summary):
+        route = summary['route'] or 'unmatched'
+        REQUESTS.labels(summary['method'], route, summary['status']).inc()
+        REQUEST_LATENCY.labels(route).observe(summary['latency'])
+        REQUEST_DB_TIME.labels(route).observe(summary['db_time'])
+        REQUEST_DB_QUERIES.labels(route).observe(summary['db_queries'])
+
+    def observe_query(self, statement, elapsed):
+        QUERY_LATENCY.observe(elapsed)
+
+    def export(self):
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -7,6 +7,8 @@ from flask import current_app
 
 from alembic import context
 
+from partitions import PARTITION_NAME
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -71,6 +73,14 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # Tables that are not in the models and must not be dropped by
+    # autogenerate: backfill.py's checkpoints, and the month partitions of
+    # "Show" and "ShowArchive" (with their indexes)
+    def include_object(object, name, type_, reflected, compare_to):
+        table = name if type_ == 'table' else getattr(getattr(object, 'table', None), 'name', '')
+        return not (table == 'backfill_checkpoint' or PARTITION_NAME.match(table)
+                    or table in ('Show_default', 'ShowArchive_default'))
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
@@ -78,6 +88,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,27 @@
+"""add version columns to Venue and Artist
+
+Revision ID: 35b5c11ea5e2
+Revises: 1e725b0330f7
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '35b5c11ea5e2'
+down_revision = '1e725b0330f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant server default lets Postgres add the column without rewriting the table
+    op.add_column('Venue', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Artist', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
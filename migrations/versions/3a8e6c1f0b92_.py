@@ -0,0 +1,30 @@
+"""add ViewCount
+
+Revision ID: 3a8e6c1f0b92
+Revises: 7d2f0b6a9c31
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a8e6c1f0b92'
+down_revision = '7d2f0b6a9c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ViewCount',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('views', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'day', 'entity_id')
+    )
+
+
+def downgrade():
+    op.drop_table('ViewCount')
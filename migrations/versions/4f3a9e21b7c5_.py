@@ -0,0 +1,30 @@
+"""index Show and ShowArchive by venue and artist for keyset pages of past shows
+
+Revision ID: 4f3a9e21b7c5
+Revises: 65bc840282d0
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f3a9e21b7c5'
+down_revision = '65bc840282d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Created on the partitioned parents, so every partition (and every
+    # partition created or attached later) gets its own copy
+    for table in ('Show', 'ShowArchive'):
+        op.create_index('ix_{}_venue_id_start_time'.format(table), table, ['venue_id', 'start_time', 'id'])
+        op.create_index('ix_{}_artist_id_start_time'.format(table), table, ['artist_id', 'start_time', 'id'])
+
+
+def downgrade():
+    for table in ('Show', 'ShowArchive'):
+        op.drop_index('ix_{}_artist_id_start_time'.format(table), table_name=table)
+        op.drop_index('ix_{}_venue_id_start_time'.format(table), table_name=table)
@@ -0,0 +1,83 @@
+"""partition Show by month of start_time and add ShowArchive
+
+Revision ID: 65bc840282d0
+Revises: c910bda067ff
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '65bc840282d0'
+down_revision = 'c910bda067ff'
+branch_labels = None
+depends_on = None
+
+# Creates "<table>_y<YYYY>m<MM>" for every month from `first` to `last`
+CREATE_MONTHS = """
+DO $$
+DECLARE month date;
+BEGIN
+  FOR month IN SELECT generate_series({first}, {last}, interval '1 month')::date LOOP
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                   '{table}_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                   '{table}', month, (month + interval '1 month')::date);
+  END LOOP;
+END $$;
+"""
+
+
+def create_partitioned(name):
+    op.execute("""
+        CREATE TABLE "{name}" (
+            id integer NOT NULL DEFAULT nextval('"Show_id_seq"'),
+            artist_id integer NOT NULL REFERENCES "Artist" (id) ON DELETE CASCADE,
+            venue_id integer NOT NULL REFERENCES "Venue" (id) ON DELETE CASCADE,
+            start_time timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, start_time)
+        ) PARTITION BY RANGE (start_time)
+    """.format(name=name))
+
+
+def upgrade():
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_unpartitioned"')
+    op.execute('ALTER TABLE "Show_unpartitioned" RENAME CONSTRAINT "Show_pkey" TO "Show_unpartitioned_pkey"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY NONE')
+
+    create_partitioned('Show')
+    op.execute('CREATE TABLE "Show_default" PARTITION OF "Show" DEFAULT')
+    # Months holding existing shows, through a year ahead
+    op.execute(CREATE_MONTHS.format(
+        table='Show',
+        first="date_trunc('month', LEAST(now(), (SELECT min(start_time) FROM \"Show_unpartitioned\")))",
+        last="date_trunc('month', now()) + interval '12 months'"))
+    op.execute('INSERT INTO "Show" (id, artist_id, venue_id, start_time) '
+               'SELECT id, artist_id, venue_id, COALESCE(start_time, now()) FROM "Show_unpartitioned"')
+    op.execute('DROP TABLE "Show_unpartitioned"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+
+    create_partitioned('ShowArchive')
+    op.execute('CREATE TABLE "ShowArchive_default" PARTITION OF "ShowArchive" DEFAULT')
+
+
+def downgrade():
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY NONE')
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_partitioned"')
+    op.execute('ALTER TABLE "Show_partitioned" RENAME CONSTRAINT "Show_pkey" TO "Show_partitioned_pkey"')
+    op.create_table('Show',
+    sa.Column('id', sa.Integer(), server_default=sa.text('nextval(\'"Show_id_seq"\')'), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "Show" (id, artist_id, venue_id, start_time) '
+               'SELECT id, artist_id, venue_id, start_time FROM "Show_partitioned" '
+               'UNION ALL SELECT id, artist_id, venue_id, start_time FROM "ShowArchive"')
+    op.execute('DROP TABLE "Show_partitioned"')
+    op.execute('DROP TABLE "ShowArchive"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
@@ -0,0 +1,36 @@
+"""add IdempotencyKey
+
+Revision ID: 7d2f0b6a9c31
+Revises: e5a1c9d4f208
+Create Date: 2026-10-19 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f0b6a9c31'
+down_revision = 'e5a1c9d4f208'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('IdempotencyKey',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('headers', sa.JSON(), nullable=True),
+    sa.Column('body', sa.LargeBinary(), nullable=True),
+    sa.Column('flashes', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_IdempotencyKey_expires_at'), 'IdempotencyKey', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_IdempotencyKey_expires_at'), table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
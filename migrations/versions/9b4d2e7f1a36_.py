@@ -0,0 +1,26 @@
+"""index the genre index by state for bounded match candidates
+
+Revision ID: 9b4d2e7f1a36
+Revises: 3a8e6c1f0b92
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4d2e7f1a36'
+down_revision = '3a8e6c1f0b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_VenueGenre_genre_state_venue_id', 'VenueGenre', ['genre', 'state', 'venue_id'])
+    op.create_index('ix_ArtistGenre_genre_state_artist_id', 'ArtistGenre', ['genre', 'state', 'artist_id'])
+
+
+def downgrade():
+    op.drop_index('ix_ArtistGenre_genre_state_artist_id', table_name='ArtistGenre')
+    op.drop_index('ix_VenueGenre_genre_state_venue_id', table_name='VenueGenre')
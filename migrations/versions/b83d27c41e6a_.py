@@ -0,0 +1,41 @@
+"""add show capacity and per-seat Ticket rows
+
+Revision ID: b83d27c41e6a
+Revises: 4f3a9e21b7c5
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83d27c41e6a'
+down_revision = '4f3a9e21b7c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Both tables, since archived months are attached to ShowArchive as-is
+    op.add_column('Show', sa.Column('capacity', sa.Integer(), nullable=True))
+    op.add_column('ShowArchive', sa.Column('capacity', sa.Integer(), nullable=True))
+    op.create_table('Ticket',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('show_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=10), server_default='available', nullable=False),
+    sa.Column('hold_token', sa.String(length=32), nullable=True),
+    sa.Column('held_until', sa.DateTime(), nullable=True),
+    sa.Column('sold_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Ticket_show_id_status', 'Ticket', ['show_id', 'status'])
+    op.create_index(op.f('ix_Ticket_hold_token'), 'Ticket', ['hold_token'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Ticket_hold_token'), table_name='Ticket')
+    op.drop_index('ix_Ticket_show_id_status', table_name='Ticket')
+    op.drop_table('Ticket')
+    op.drop_column('ShowArchive', 'capacity')
+    op.drop_column('Show', 'capacity')
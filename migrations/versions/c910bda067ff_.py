@@ -0,0 +1,63 @@
+"""add genre index tables for artist/venue matching
+
+Revision ID: c910bda067ff
+Revises: 35b5c11ea5e2
+Create Date: 2026-10-19 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c910bda067ff'
+down_revision = '35b5c11ea5e2'
+branch_labels = None
+depends_on = None
+
+
+def backfill(source, seeking, index, id_column):
+    """
+    Fill an index table from the pickled genres of every seeking entity.
+    """
+    conn = op.get_bind()
+    entities = sa.table(source, sa.column('id', sa.Integer), sa.column('genres', sa.PickleType),
+                        sa.column('city', sa.String), sa.column('state', sa.String),
+                        sa.column(seeking, sa.Boolean))
+    rows = []
+    for entity in conn.execute(sa.select(entities).where(entities.c[seeking].is_(True))):
+        rows.extend({'genre': genre, id_column: entity.id, 'city': entity.city, 'state': entity.state}
+                    for genre in set(entity.genres or []))
+    if rows:
+        op.bulk_insert(index, rows)
+
+
+def upgrade():
+    venue_genre = op.create_table('VenueGenre',
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=True),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre', 'venue_id')
+    )
+    op.create_index(op.f('ix_VenueGenre_venue_id'), 'VenueGenre', ['venue_id'], unique=False)
+    artist_genre = op.create_table('ArtistGenre',
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=True),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre', 'artist_id')
+    )
+    op.create_index(op.f('ix_ArtistGenre_artist_id'), 'ArtistGenre', ['artist_id'], unique=False)
+
+    backfill('Venue', 'seeking_talent', venue_genre, 'venue_id')
+    backfill('Artist', 'seeking_venue', artist_genre, 'artist_id')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_ArtistGenre_artist_id'), table_name='ArtistGenre')
+    op.drop_table('ArtistGenre')
+    op.drop_index(op.f('ix_VenueGenre_venue_id'), table_name='VenueGenre')
+    op.drop_table('VenueGenre')
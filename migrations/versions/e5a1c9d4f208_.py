@@ -0,0 +1,28 @@
+"""add updated_at to Venue and Artist
+
+Revision ID: e5a1c9d4f208
+Revises: b83d27c41e6a
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c9d4f208'
+down_revision = 'b83d27c41e6a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the time of the migration
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                       server_default=sa.text("(now() at time zone 'utc')")))
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_column(table, 'updated_at')
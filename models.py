@@ -29,6 +29,13 @@ class Venue(db.Model):
     seeking_description = db.Column(db.Text)
     shows = db.relationship('Show', backref="venue", lazy=True, passive_deletes=True)
 
+    # Bumped on every UPDATE, which only applies if the row still has the version that was read
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+    # Last change, in UTC; the lastmod of the page in the sitemap
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.text("(now() at time zone 'utc')"))
+
     @hybrid_property
     def past_shows(self):
       past_shows = Show.query.filter(
@@ -72,6 +79,13 @@ class Artist(db.Model):
     seeking_description = db.Column(db.Text)
     shows = db.relationship('Show', backref="artist", lazy=True, passive_deletes=True)
 
+    # Bumped on every UPDATE, which only applies if the row still has the version that was read
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+    # Last change, in UTC; the lastmod of the page in the sitemap
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.text("(now() at time zone 'utc')"))
+
 
     @hybrid_property
     def past_shows(self):
@@ -101,12 +115,22 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    # One partition per month of start_time; see partitions.py. The indexes
+    # serve the keyset pages of a venue's or an artist's past shows.
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time', 'id'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time', 'id'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
 
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
 
-    start_time = db.Column(db.DateTime, default=datetime.utcnow)
+    # Part of the primary key, as Postgres requires for the partition key
+    start_time = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
+    # Seats on sale as Ticket rows; None when the show is not ticketed here
+    capacity = db.Column(db.Integer)
 
     # Usefulness of hybrid property
     # https://docs.sqlalchemy.org/en/13/orm/mapped_sql_expr.html#using-a-hybrid
@@ -132,3 +156,111 @@ class Show(db.Model):
       venue_image_link = Venue.query.filter(Venue.id == self.venue_id).first().image_link
       return venue_image_link
 
+
+class ShowArchive(db.Model):
+    """
+    Past shows moved out of Show by month (flask shows archive). Read only,
+    and only loaded when someone asks for a venue's or artist's old history.
+    """
+    __tablename__ = 'ShowArchive'
+    __table_args__ = (
+        db.Index('ix_ShowArchive_venue_id_start_time', 'venue_id', 'start_time', 'id'),
+        db.Index('ix_ShowArchive_artist_id_start_time', 'artist_id', 'start_time', 'id'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    start_time = db.Column(db.DateTime, primary_key=True)
+    capacity = db.Column(db.Integer)
+
+#----------------------------------------------------------------------------#
+# Genre index.
+#
+# Inverted index from genre to the venues seeking talent and the artists
+# seeking a venue, kept in step by matching.py on create and edit. Entities
+# that are not seeking have no rows, and city/state are copied in so matches
+# can be ranked from the index alone.
+#----------------------------------------------------------------------------#
+
+class VenueGenre(db.Model):
+    __tablename__ = 'VenueGenre'
+    # Serves the same-state candidates of a genre in id order; see matching.py
+    __table_args__ = (db.Index('ix_VenueGenre_genre_state_venue_id', 'genre', 'state', 'venue_id'),)
+
+    genre = db.Column(db.String(120), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True, index=True)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+
+
+class ArtistGenre(db.Model):
+    __tablename__ = 'ArtistGenre'
+    # Serves the same-state candidates of a genre in id order; see matching.py
+    __table_args__ = (db.Index('ix_ArtistGenre_genre_state_artist_id', 'genre', 'state', 'artist_id'),)
+
+    genre = db.Column(db.String(120), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True, index=True)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+
+#----------------------------------------------------------------------------#
+# Tickets.
+#----------------------------------------------------------------------------#
+
+class Ticket(db.Model):
+    """
+    One row per seat of a ticketed show. Seats are held and sold row by row
+    (see tickets.py), so concurrent buyers of one show lock different rows
+    instead of queueing on a shared counter.
+    """
+    __tablename__ = 'Ticket'
+    __table_args__ = (db.Index('ix_Ticket_show_id_status', 'show_id', 'status'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: months of Show are detached when they are archived
+    show_id = db.Column(db.Integer, nullable=False)
+    # 'available', 'held' until held_until, or 'sold'
+    status = db.Column(db.String(10), nullable=False, server_default='available')
+    hold_token = db.Column(db.String(32), index=True)
+    held_until = db.Column(db.DateTime)
+    sold_at = db.Column(db.DateTime)
+
+#----------------------------------------------------------------------------#
+# Idempotency keys.
+#----------------------------------------------------------------------------#
+
+class IdempotencyKey(db.Model):
+    """
+    The response to the first POST made with a key, replayed to its
+    duplicates until expires_at (see idempotency.py).
+    """
+    __tablename__ = 'IdempotencyKey'
+
+    key = db.Column(db.String(64), primary_key=True)
+    # Hash of the endpoint and form the key was first used with
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer)
+    headers = db.Column(db.JSON)
+    body = db.Column(db.LargeBinary)
+    flashes = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
+
+class ViewCount(db.Model):
+    """
+    Page views of a venue or an artist on one UTC day, added to by the
+    write-behind counters in trending.py.
+    """
+    __tablename__ = 'ViewCount'
+
+    # Key order serves the leaderboards: one kind, a range of days
+    kind = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    views = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,159 @@
+import re
+from datetime import date, datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from models import db
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#
+# "Show" is range partitioned by start_time into one partition per month,
+# named "Show_y<YYYY>m<MM>", plus a default partition that only catches
+# rows outside every month created so far. "ShowArchive" is partitioned the
+# same way; archiving detaches whole months from "Show" and attaches them to
+# "ShowArchive", which moves no rows.
+#----------------------------------------------------------------------------#
+
+PARTITION_NAME = re.compile(r'^(Show|ShowArchive)_y(\d{4})m(\d{2})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '{}_y{:04d}m{:02d}'.format(table, month.year, month.month)
+
+
+def partitions(conn, table):
+    """
+    The month partitions attached to table, as {month: name}.
+    """
+    rows = conn.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+        'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+        'WHERE parent.relname = :table'), {'table': table})
+    months = {}
+    for name, in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[date(int(match.group(2)), int(match.group(3)), 1)] = name
+    return months
+
+
+def bounds(month):
+    return "FOR VALUES FROM ('{}') TO ('{}')".format(month, add_months(month, 1))
+
+
+def move_default_rows(conn, table, month, name):
+    """
+    Move the rows of the month out of table's default partition into the
+    standalone table name, which is about to be attached for that month: the
+    attach fails while the default partition holds any of them.
+    """
+    conn.execute(text(
+        'WITH moved AS (DELETE FROM "{0}_default" WHERE start_time >= :start AND start_time < :stop RETURNING *) '
+        'INSERT INTO "{1}" SELECT * FROM moved'.format(table, name)),
+        {'start': month, 'stop': add_months(month, 1)})
+
+
+def create_partition(conn, table, month):
+    name = partition_name(table, month)
+    stray = conn.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM "{}_default" WHERE start_time >= :start AND start_time < :stop)'.format(table)),
+        {'start': month, 'stop': add_months(month, 1)}).scalar()
+    if not stray:
+        conn.execute(text('CREATE TABLE "{}" PARTITION OF "{}" {}'.format(name, table, bounds(month))))
+        return
+    # Shows entered for a month before its partition existed: create the
+    # month standalone, move them in and attach it, in the caller's transaction
+    conn.execute(text('CREATE TABLE "{}" (LIKE "{}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name, table)))
+    move_default_rows(conn, table, month, name)
+    conn.execute(text('ALTER TABLE "{}" ATTACH PARTITION "{}" {}'.format(table, name, bounds(month))))
+
+
+def ensure_partitions(conn, months_ahead=12, today=None):
+    """
+    Create every missing month partition of "Show" from the current month up
+    to months_ahead months from now. Returns the names created.
+    """
+    first = month_start(today or datetime.utcnow())
+    existing = partitions(conn, 'Show')
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        if month not in existing:
+            create_partition(conn, 'Show', month)
+            created.append(partition_name('Show', month))
+    return created
+
+
+def archive_partitions(conn, before):
+    """
+    Move every month of "Show" that ends on or before the month of `before`
+    into "ShowArchive". Detach and attach only touch the catalog, so rows are
+    not copied. Returns the names moved.
+    """
+    cutoff = month_start(before)
+    moved = []
+    for month, name in sorted(partitions(conn, 'Show').items()):
+        if add_months(month, 1) > cutoff:
+            continue
+        conn.execute(text('ALTER TABLE "Show" DETACH PARTITION "{}"'.format(name)))
+        move_default_rows(conn, 'ShowArchive', month, name)
+        conn.execute(text('ALTER TABLE "ShowArchive" ATTACH PARTITION "{}" {}'.format(name, bounds(month))))
+        moved.append(name)
+
+    # Stray old rows that landed in the default partition move with one statement
+    archive_months = partitions(conn, 'ShowArchive')
+    for month in sorted(conn.execute(text(
+            'SELECT DISTINCT date_trunc(\'month\', start_time)::date FROM "Show_default" WHERE start_time < :cutoff'),
+            {'cutoff': cutoff}).scalars()):
+        if month not in archive_months:
+            create_partition(conn, 'ShowArchive', month)
+    conn.execute(text(
+        'WITH moved AS (DELETE FROM "Show_default" WHERE start_time < :cutoff RETURNING *) '
+        'INSERT INTO "ShowArchive" (id, artist_id, venue_id, start_time, capacity) '
+        'SELECT id, artist_id, venue_id, start_time, capacity FROM moved'), {'cutoff': cutoff})
+    return moved
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+shows_cli = AppGroup('shows', help='Maintain the partitions of the Show table.')
+
+
+@shows_cli.command('ensure-partitions')
+@click.option('--months-ahead', default=None, type=int, help='How many future months to create.')
+def ensure_partitions_command(months_ahead):
+    """Create missing monthly partitions ahead of time."""
+    with db.engine.begin() as conn:
+        created = ensure_partitions(conn, months_ahead or current_app.config['SHOW_PARTITION_MONTHS_AHEAD'])
+    click.echo('Created {} partition(s) {}'.format(len(created), ' '.join(created)))
+
+
+@shows_cli.command('archive')
+@click.option('--months', default=None, type=int, help='Archive months that ended more than this many months ago.')
+def archive_command(months):
+    """Move old months of shows into ShowArchive."""
+    months = months or current_app.config['SHOW_ARCHIVE_AFTER_MONTHS']
+    with db.engine.begin() as conn:
+        moved = archive_partitions(conn, add_months(month_start(datetime.utcnow()), -months))
+    click.echo('Archived {} partition(s) {}'.format(len(moved), ' '.join(moved)))
+
+
+@shows_cli.command('maintain')
+@click.pass_context
+def maintain_command(ctx):
+    """Create future partitions and archive old ones; run daily from cron."""
+    ctx.invoke(ensure_partitions_command)
+    ctx.invoke(archive_command)
@@ -0,0 +1,299 @@
+"""
+Query plan check for Fyyur's hot routes.
+
+Requests every route in ROUTES through the test client against the database
+in config.py, records every SQL statement the route issues, EXPLAINs each
+one and checks the route's rules:
+
+  max_queries   no more statements than this (listing and fragment caches
+                are cleared first, so this is the cold-cache count)
+  no_seq_scan   tables (partitioned or not) that must not be read by a
+                sequential scan, except for relations under --min-pages
+  indexes       tables that some statement must read through an index, unless
+                every relation of theirs it read is under --min-pages
+
+  python plancheck.py --seed --shows 20000 --ticketed 200
+  python plancheck.py --save plans.json
+  python plancheck.py --baseline plans.json
+
+Postgres plans tiny tables with sequential scans whatever their indexes, so
+run it against a database of realistic size (--seed fills one the way
+loadtest.py does and puts seats of some shows on sale); the tables are
+ANALYZEd before the run. A failing rule
+prints the route's statements with their plans, the offending nodes marked.
+With --baseline, a route whose plan shape differs from the saved one also
+fails, with a diff of the two shapes. Exits with status 1 on any failure.
+"""
+import argparse
+import difflib
+import json
+import sys
+from sqlalchemy import event
+
+from app import app
+from models import db, Venue, Artist, Show, ShowArchive, Ticket, ViewCount
+from loadtest import seed
+from tickets import create_tickets
+
+#----------------------------------------------------------------------------#
+# Rules.
+#----------------------------------------------------------------------------#
+
+# Paths are formatted with the ids of the busiest venue and artist, a show
+# with tickets on sale, and the venue's city and state
+ROUTES = [
+    {'path': '/', 'max_queries': 2, 'no_seq_scan': ('ViewCount',)},
+    {'path': '/venues', 'max_queries': 1},
+    {'path': '/venues/search', 'method': 'POST', 'data': {'search_term': 'Venue 1'}, 'max_queries': 1},
+    {'path': '/venues/{venue_id}', 'max_queries': 4,
+     'no_seq_scan': ('Show', 'ShowArchive'), 'indexes': ('Venue', 'Show', 'ShowArchive')},
+    {'path': '/venues/{venue_id}/past_shows', 'max_queries': 2,
+     'no_seq_scan': ('Show', 'ShowArchive'), 'indexes': ('Show', 'ShowArchive')},
+    {'path': '/venues/{venue_id}/shows.ics', 'max_queries': 3, 'no_seq_scan': ('Show',), 'indexes': ('Show',)},
+    {'path': '/venues/{venue_id}/matches', 'max_queries': 3, 'no_seq_scan': ('Show',)},
+    {'path': '/areas/{state}/{city}/shows.ics', 'max_queries': 2},
+    {'path': '/artists', 'max_queries': 1},
+    {'path': '/artists/search', 'method': 'POST', 'data': {'search_term': 'Artist 1'}, 'max_queries': 1},
+    {'path': '/artists/{artist_id}', 'max_queries': 4,
+     'no_seq_scan': ('Show', 'ShowArchive'), 'indexes': ('Artist', 'Show', 'ShowArchive')},
+    {'path': '/artists/{artist_id}/past_shows', 'max_queries': 2,
+     'no_seq_scan': ('Show', 'ShowArchive'), 'indexes': ('Show', 'ShowArchive')},
+    {'path': '/artists/{artist_id}/shows.ics', 'max_queries': 3, 'no_seq_scan': ('Show',), 'indexes': ('Show',)},
+    {'path': '/artists/{artist_id}/matches', 'max_queries': 3, 'no_seq_scan': ('Show',)},
+    {'path': '/shows', 'max_queries': 1},
+    {'path': '/shows/{show_id}/tickets', 'max_queries': 1, 'no_seq_scan': ('Ticket',), 'indexes': ('Ticket',)},
+]
+
+SCANS = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan')
+
+PARENTS = '''
+SELECT child.relname, parent.relname FROM pg_inherits
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+'''
+
+SIZES = "SELECT relname, relpages FROM pg_class WHERE relkind = 'r'"
+
+#----------------------------------------------------------------------------#
+# Plans.
+#----------------------------------------------------------------------------#
+
+class Plans:
+    """
+    EXPLAIN statements and read their plans in terms of the tables and
+    indexes declared in models.py: partitions (of Show, and the months
+    attached to ShowArchive) and their indexes stand for their parent.
+    """
+
+    def __init__(self, conn, min_pages):
+        self.conn = conn
+        self.min_pages = min_pages
+        self.parents = dict(conn.exec_driver_sql(PARENTS).fetchall())
+        self.pages = dict(conn.exec_driver_sql(SIZES).fetchall())
+
+    def parent(self, name):
+        while name in self.parents:
+            name = self.parents[name]
+        return name
+
+    def explain(self, statement, parameters):
+        return self.conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()[0]['Plan']
+
+    def nodes(self, plan, depth=0):
+        yield depth, plan
+        for child in plan.get('Plans', ()):
+            yield from self.nodes(child, depth + 1)
+
+    def describe(self, node):
+        text = node['Node Type']
+        if node.get('Join Type') and 'Join' in text or node['Node Type'] == 'Nested Loop':
+            text = '{} {}'.format(node.get('Join Type', ''), text).strip()
+        if 'Index Name' in node:
+            text += ' using ' + self.parent(node['Index Name'])
+        if 'Relation Name' in node:
+            text += ' on ' + self.parent(node['Relation Name'])
+        return text
+
+    def sequential(self, node):
+        """
+        Whether node reads a relation too large to be scanned whole; below
+        min_pages a sequential scan is as cheap as any index.
+        """
+        return node['Node Type'] == 'Seq Scan' and self.pages.get(node['Relation Name'], 0) >= self.min_pages
+
+    def shape(self, plan, marks=None):
+        """
+        The plan as indented lines of node types, tables and indexes, without
+        costs or conditions, with marks appended to the nodes they name. The
+        children of an Append that differ only in their partition are listed
+        once, so the shape does not change as months are added or pruned.
+        """
+        marks = marks or {}
+        lines = []
+
+        def line(node, depth):
+            return '  ' * depth + self.describe(node) + ('  <-- ' + marks[id(node)] if id(node) in marks else '')
+
+        def walk(node, depth):
+            lines.append(line(node, depth))
+            seen = []
+            for child in node.get('Plans', ()):
+                described = [line(n, d) for d, n in self.nodes(child)]
+                if described in seen:
+                    continue
+                seen.append(described)
+                walk(child, depth + 1)
+
+        walk(plan, 0)
+        return lines
+
+#----------------------------------------------------------------------------#
+# Checks.
+#----------------------------------------------------------------------------#
+
+def capture(client, route, values):
+    """
+    Request route and return its status and the statements it issued.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    app.extensions['listing_cache'].backend.clear()
+    app.jinja_env.fragment_cache.clear()
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.open(route['path'].format(**values), method=route.get('method', 'GET'),
+                               data=route.get('data'))
+        response.get_data()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response.status_code, statements
+
+
+def check(plans, route, status, statements):
+    """
+    Return the route's failures, the plan of each statement and its shape.
+    """
+    failures = []
+    if status != 200:
+        failures.append('returned {}'.format(status))
+    if len(statements) > route['max_queries']:
+        failures.append('issued {} queries, at most {} allowed'.format(len(statements), route['max_queries']))
+
+    explained, read, indexed, large = [], set(), set(), set()
+    for statement, parameters in statements:
+        plan = plans.explain(statement, parameters)
+        marks = {}
+        for depth, node in plans.nodes(plan):
+            if node['Node Type'] not in SCANS or 'Relation Name' not in node:
+                continue
+            table = plans.parent(node['Relation Name'])
+            if table in route.get('no_seq_scan', ()) and plans.sequential(node):
+                marks[id(node)] = 'sequential scan on {}'.format(table)
+            read.add(table)
+            if node['Node Type'] in INDEX_SCANS:
+                indexed.add(table)
+            elif plans.sequential(node):
+                large.add(table)
+        failures.extend(sorted(set(marks.values())))
+        explained.append((statement, plan, marks))
+
+    for table in route.get('indexes', ()):
+        if table not in indexed and (table not in read or table in large):
+            failures.append('no index used on {}'.format(table))
+    shape = [line for _, plan, _ in explained for line in ['--'] + plans.shape(plan)]
+    return failures, explained, shape
+
+
+def print_plans(plans, explained):
+    for statement, plan, marks in explained:
+        print('    ' + ' '.join(statement.split()))
+        for line in plans.shape(plan, marks):
+            print('      ' + line)
+
+
+def sample_values():
+    """
+    The busiest venue and artist make for the largest pages.
+    """
+    busiest = lambda column: db.session.query(column).group_by(column).order_by(db.func.count().desc()).limit(1).scalar()
+    venue_id, artist_id = busiest(Show.venue_id), busiest(Show.artist_id)
+    if venue_id is None:
+        sys.exit('The database has no shows; run with --seed.')
+    venue = Venue.query.get(venue_id)
+    show_id = db.session.query(Ticket.show_id).limit(1).scalar()
+    if show_id is None:
+        sys.exit('No show has tickets on sale; run with --seed.')
+    return {'venue_id': venue_id, 'artist_id': artist_id, 'show_id': show_id,
+            'state': venue.state, 'city': venue.city}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='insert generated data before the run')
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--ticketed', type=int, default=200, help='upcoming shows to put seats on sale for')
+    parser.add_argument('--capacity', type=int, default=100)
+    parser.add_argument('--min-pages', type=int, default=10,
+                        help='allow sequential scans of relations smaller than this many pages')
+    parser.add_argument('--save', metavar='FILE', help='write the plan shape of every route to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='fail routes whose plan shape differs from FILE')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.venues, args.artists, args.shows)
+        with app.app_context():
+            create_tickets([id for id, in db.session.query(Show.id).filter(
+                Show.start_time > db.func.now()).limit(args.ticketed)], args.capacity)
+            db.session.commit()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    shapes, failed = {}, 0
+    with app.app_context():
+        for model in (Venue, Artist, Show, ShowArchive, Ticket, ViewCount):
+            db.session.execute(db.text('ANALYZE "{}"'.format(model.__tablename__)))
+        db.session.commit()
+        values = sample_values()
+        db.session.remove()
+
+        client = app.test_client()
+        with db.engine.connect() as conn:
+            plans = Plans(conn, args.min_pages)
+            for route in ROUTES:
+                name = '{} {}'.format(route.get('method', 'GET'), route['path'])
+                status, statements = capture(client, route, values)
+                failures, explained, shape = check(plans, route, status, statements)
+                shapes[name] = shape
+
+                diff = []
+                if name in baseline and baseline[name] != shape:
+                    failures.append('plan changed from the baseline')
+                    diff = difflib.unified_diff(baseline[name], shape, 'baseline', 'now', lineterm='')
+
+                print('{:<4} {:<40} {:>3} queries'.format('FAIL' if failures else 'ok', name, len(statements)))
+                if failures:
+                    failed += 1
+                    for failure in failures:
+                        print('    ' + failure)
+                    for line in diff:
+                        print('    ' + line)
+                    print_plans(plans, explained)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(shapes, f, indent=2)
+    print('{} of {} routes failed'.format(failed, len(ROUTES)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import time
+from flask import g, request, render_template, abort, Response
+
+#----------------------------------------------------------------------------#
+# On-demand profiling.
+#----------------------------------------------------------------------------#
+
+# <endpoint>-<milliseconds>-<pid>.prof, as written by Profiler.stop
+PROFILE_NAME = re.compile(r'^.+-\d+-\d+\.prof$')
+
+
+class Profiler:
+    """
+    Run cProfile for a request when it carries the PROFILE_HEADER set to
+    PROFILE_SECRET, or for a PROFILE_SAMPLE_RATE fraction of requests. Each
+    profile is saved to PROFILE_DIR, named after its endpoint, and listed at
+    /admin/profiles (HTTP basic auth with the secret as password); only the
+    newest PROFILE_MAX_FILES are kept.
+
+    With neither a secret nor a sample rate configured nothing is registered,
+    so requests pay nothing.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.secret = app.config.get('PROFILE_SECRET')
+        self.header = app.config.get('PROFILE_HEADER', 'X-Profile')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+        self.directory = app.config.get('PROFILE_DIR', 'profiles')
+        self.top = app.config.get('PROFILE_TOP_FUNCTIONS', 30)
+        self.max_files = app.config.get('PROFILE_MAX_FILES', 500)
+
+        self.enabled = bool(self.secret or self.sample_rate)
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self.start)
+        app.after_request(self.stop)
+        app.teardown_request(self.discard)
+        if self.secret:
+            app.add_url_rule('/admin/profiles', 'profiles', self.index)
+            app.add_url_rule('/admin/profiles/<name>', 'profile', self.detail)
+
+    def authorized(self, supplied):
+        if not (self.secret and supplied):
+            return False
+        try:
+            # Header values arrive as latin-1; compare_digest only takes ASCII str
+            supplied = supplied.encode('latin-1')
+        except UnicodeEncodeError:
+            return False
+        return hmac.compare_digest(supplied, self.secret.encode())
+
+    def start(self):
+        if request.endpoint in (None, 'static', 'profiles', 'profile'):
+            return
+        if self.authorized(request.headers.get(self.header)) or random.random() < self.sample_rate:
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    def stop(self, response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            name = '{}-{}-{}.prof'.format(request.endpoint, int(time.time() * 1000), os.getpid())
+            profile.dump_stats(os.path.join(self.directory, name))
+            response.headers['X-Profile-Name'] = name
+            self.prune()
+        return response
+
+    def prune(self):
+        """
+        Delete the oldest profiles beyond PROFILE_MAX_FILES, so sampling does
+        not fill the disk.
+        """
+        names = [name for name in os.listdir(self.directory) if PROFILE_NAME.match(name)]
+        if len(names) <= self.max_files:
+            return
+        # By the millisecond timestamp in the name, which needs no stat of a
+        # file another worker may be deleting
+        names.sort(key=lambda name: int(name[:-len('.prof')].rsplit('-', 2)[1]))
+        for name in names[:len(names) - self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Pruned by another worker meanwhile
+                pass
+
+    def discard(self, exc=None):
+        # The request failed before after_request ran
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+
+    #  Admin views
+    #  ----------------------------------------------------------------
+
+    def require_secret(self):
+        auth = request.authorization
+        if not auth or not self.authorized(auth.password):
+            abort(Response('Profiles require the profiling secret.', 401,
+                           {'WWW-Authenticate': 'Basic realm="profiles"'}))
+
+    def index(self):
+        self.require_secret()
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.prof'):
+                endpoint, timestamp, pid = name[:-len('.prof')].rsplit('-', 2)
+                profiles.append({
+                    'name': name,
+                    'endpoint': endpoint,
+                    'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(timestamp) / 1000)),
+                })
+        profiles.sort(key=lambda p: p['name'].rsplit('-', 2)[1], reverse=True)
+        return render_template('pages/profiles.html', profiles=profiles[:200])
+
+    def detail(self, name):
+        self.require_secret()
+        path = os.path.join(self.directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            abort(404)
+
+        stats = pstats.Stats(path)
+        functions = []
+        for (filename, line, function), (cc, calls, tottime, cumtime, callers) in stats.stats.items():
+            functions.append({
+                'function': function,
+                'where': '{}:{}'.format(filename, line),
+                'calls': calls,
+                'tottime': tottime,
+                'cumtime': cumtime,
+            })
+        functions.sort(key=lambda f: f['cumtime'], reverse=True)
+        return render_template('pages/profile.html', name=name, total=stats.total_tt,
+                               functions=functions[:self.top])
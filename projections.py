@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Projections.
+#
+# Listing pages only print a few columns of each row. Rather than loading
+# ORM instances (with their pickled genres, descriptions and identity map
+# bookkeeping), these queries select just those columns and return plain
+# named tuples: immutable, untracked by the session and cheap to cache.
+#----------------------------------------------------------------------------#
+
+class Listed(NamedTuple):
+    """
+    A venue or an artist in a list of links.
+    """
+    id: int
+    name: str
+
+
+class Area(NamedTuple):
+    city: str
+    state: str
+    venues: Tuple[Listed, ...]
+
+
+class ShowTile(NamedTuple):
+    id: int
+    venue_id: int
+    venue_name: str
+    venue_image_link: Optional[str]
+    venue_version: int
+    artist_id: int
+    artist_name: str
+    artist_image_link: Optional[str]
+    artist_version: int
+    start_time: datetime
+
+
+def project(cls, query):
+    """
+    Run a query whose columns are cls's fields, in order, into cls tuples.
+    """
+    return [cls._make(row) for row in query]
+
+
+def listed(model):
+    return db.session.query(model.id, model.name)
+
+
+def show_tiles(table):
+    """
+    Show or ShowArchive rows with the ShowTile columns of their venue and
+    artist joined in.
+    """
+    return db.session.query(
+        table.id, table.venue_id, Venue.name, Venue.image_link, Venue.version,
+        table.artist_id, Artist.name, Artist.image_link, Artist.version,
+        table.start_time).join(Venue, table.venue_id == Venue.id).join(Artist, table.artist_id == Artist.id)
+
+
+class Trending(NamedTuple):
+    """
+    A venue or an artist on a leaderboard, with its views in the window.
+    """
+    id: int
+    name: str
+    image_link: Optional[str]
+    views: int
@@ -0,0 +1,174 @@
+import math
+import sqlite3
+import threading
+import time
+from flask import g, request
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+#----------------------------------------------------------------------------#
+# Token buckets.
+#----------------------------------------------------------------------------#
+
+def refill(tokens, updated, rate, burst, now):
+    """
+    Top a bucket up for the time elapsed since it was last touched.
+    """
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """
+    Buckets kept in this process. Each worker enforces its own limits.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """
+        Take one token from the bucket. Return the seconds to wait before
+        retrying, or 0 when the request is allowed.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, rate, burst, now)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Buckets idle long enough to be full again carry no state worth keeping
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if now - updated > 60:
+                del self._buckets[key]
+
+
+class SqliteBackend:
+    """
+    Buckets kept in a SQLite file, shared by every worker on the host.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = refill(row[0], row[1], rate, burst, now) if row else burst
+            if tokens >= 1:
+                tokens, wait = tokens - 1, 0
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def make_backend(url):
+    """
+    'memory' for per-process buckets, or 'sqlite:///<path>' to share them.
+    """
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SqliteBackend(url[len('sqlite:///'):])
+    raise ValueError('Unknown rate limit storage "{}"'.format(url))
+
+#----------------------------------------------------------------------------#
+# Flask extensions.
+#----------------------------------------------------------------------------#
+
+class RateLimiter:
+    """
+    Per client, per endpoint token buckets. Limits are configured in
+    RATELIMITS as {endpoint: (tokens per second, burst)}; requests over the
+    limit get a 429 with Retry-After.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = app.config.get('RATELIMITS', {}) if app.config.get('RATELIMIT_ENABLED', True) else {}
+        self.trust_proxy = app.config.get('RATELIMIT_TRUST_PROXY', False)
+        self.backend = make_backend(app.config.get('RATELIMIT_STORAGE', 'memory'))
+        app.before_request(self.check)
+
+    def client(self):
+        if self.trust_proxy and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or '-'
+
+    def check(self):
+        limit = self.limits.get(request.endpoint)
+        if limit is None:
+            return
+        rate, burst = limit
+        wait = self.backend.take('{}:{}'.format(request.endpoint, self.client()), rate, burst)
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+
+class LoadShedder:
+    """
+    Reject requests up front with a 503 once more than LOADSHED_MAX_INFLIGHT
+    database-backed requests are already running in this worker, instead of
+    queueing them behind the pool.
+    """
+
+    def __init__(self, app=None):
+        self.inflight = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_inflight = app.config.get('LOADSHED_MAX_INFLIGHT', 0)
+        self.retry_after = app.config.get('LOADSHED_RETRY_AFTER', 1)
+        if self.max_inflight:
+            app.before_request(self.enter)
+            app.teardown_request(self.leave)
+
+    def enter(self):
+        if request.endpoint in (None, 'static'):
+            return
+        with self._lock:
+            if self.inflight >= self.max_inflight:
+                raise ServiceUnavailable(retry_after=self.retry_after)
+            self.inflight += 1
+        g.loadshed_counted = True
+
+    def leave(self, exc=None):
+        if g.pop('loadshed_counted', False):
+            with self._lock:
+                self.inflight -= 1
@@ -0,0 +1,80 @@
+from dateutil.rrule import rrule, WEEKLY, MONTHLY
+from models import db, Artist, Venue, Show
+
+#----------------------------------------------------------------------------#
+# Recurring shows.
+#----------------------------------------------------------------------------#
+
+FREQUENCIES = {
+    'WEEKLY': WEEKLY,
+    'MONTHLY': MONTHLY,
+}
+
+
+class RecurrenceError(ValueError):
+    """
+    Raised when a set of occurrences cannot be listed. The message is safe
+    to flash back to the user.
+    """
+
+
+def expand_occurrences(start_time, freq=None, count=None, until=None, interval=1, limit=100):
+    """
+    Expand an RRULE-style recurrence into the list of show start times.
+    Without a frequency the show happens once, at start_time.
+    """
+    if not freq:
+        return [start_time]
+
+    if freq not in FREQUENCIES:
+        raise RecurrenceError('Unknown recurrence "{}".'.format(freq))
+    if not count and not until:
+        raise RecurrenceError('A recurring show needs either a number of occurrences or an end date.')
+    if until and until < start_time:
+        raise RecurrenceError('The recurrence ends before the first show.')
+    if count and count > limit:
+        raise RecurrenceError('A recurring show can have at most {} occurrences.'.format(limit))
+
+    rule = rrule(FREQUENCIES[freq], dtstart=start_time, interval=interval or 1,
+                 count=count or None, until=until or None)
+
+    # Stop one past the limit so an open-ended rule never expands in full
+    occurrences = []
+    for occurrence in rule:
+        occurrences.append(occurrence)
+        if len(occurrences) > limit:
+            raise RecurrenceError('A recurring show can have at most {} occurrences.'.format(limit))
+
+    return occurrences
+
+
+def validate_occurrences(artist_id, venue_id, occurrences):
+    """
+    Check a whole set of occurrences against the database with one query per
+    rule instead of one round trip per show, and return the rows to insert.
+    """
+    if not occurrences:
+        raise RecurrenceError('The recurrence does not produce any shows.')
+
+    if not db.session.query(Artist.id).filter(Artist.id == artist_id).scalar():
+        raise RecurrenceError('Artist {} does not exist.'.format(artist_id))
+    if not db.session.query(Venue.id).filter(Venue.id == venue_id).scalar():
+        raise RecurrenceError('Venue {} does not exist.'.format(venue_id))
+
+    taken = db.session.query(Show.start_time).filter(
+        Show.venue_id == venue_id).filter(Show.start_time.in_(occurrences)).order_by(Show.start_time).first()
+    if taken:
+        raise RecurrenceError('Venue {} already has a show at {}.'.format(venue_id, taken.start_time))
+
+    return [
+        {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start_time}
+        for start_time in occurrences
+    ]
+
+
+def insert_shows(rows):
+    """
+    Insert all rows with a single multi-row INSERT in the current transaction
+    and return the new show ids. The caller commits.
+    """
+    return db.session.execute(Show.__table__.insert().values(rows).returning(Show.id)).scalars().all()
@@ -0,0 +1,100 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+from datetime import datetime
+from logging import FileHandler, Formatter
+from logging.handlers import QueueHandler, QueueListener
+
+#----------------------------------------------------------------------------#
+# Non-blocking JSON logging.
+#----------------------------------------------------------------------------#
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hand records to a bounded queue. When the writer falls behind, records
+    are dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Only resolve the message here; JSON encoding happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(Formatter):
+    """
+    One JSON object per line. Request summaries passed as extra={'request': ...}
+    are merged into the top level.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'request', {}))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        elif record.levelno >= logging.ERROR:
+            entry['where'] = '{}:{}'.format(record.pathname, record.lineno)
+        return json.dumps(entry, default=str)
+
+
+class RequestLogger:
+    """
+    Write application and request logs as JSON lines through a queue, so disk
+    I/O happens on a background thread and never on the request thread.
+    """
+
+    def __init__(self, app=None, telemetry=None):
+        self.handler = None
+        self.listener = None
+        if app is not None:
+            self.init_app(app, telemetry)
+
+    def init_app(self, app, telemetry):
+        self.sample_rate = app.config.get('LOG_SAMPLE_RATE', 1.0)
+
+        file_handler = FileHandler(app.config.get('LOG_FILE', 'fyyur.log'))
+        file_handler.setFormatter(JsonFormatter())
+        self.handler = DroppingQueueHandler(queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000)))
+        self.listener = QueueListener(self.handler.queue, file_handler)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+        app.logger.setLevel(logging.INFO)
+        app.logger.addHandler(self.handler)
+
+        self.logger = logging.getLogger('fyyur.requests')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+        telemetry.on_request(self.log_request)
+
+    def log_request(self, summary):
+        # Failures are always logged, successful requests only as sampled
+        if summary['status'] < 400 and random.random() >= self.sample_rate:
+            return
+        summary = dict(summary, latency=round(summary['latency'], 6), db_time=round(summary['db_time'], 6))
+        self.logger.info('request', extra={'request': summary})
@@ -0,0 +1,108 @@
+import glob
+import gzip
+import hashlib
+import os
+from flask import Response, abort, request, send_file, stream_with_context
+from sqlalchemy import func
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Sitemaps.
+#
+# /sitemap.xml is an index of one small sitemap of the listing pages and of
+# shards of venue and artist pages. Shard k of a kind holds the ids from
+# k * SITEMAP_URLS_PER_SHARD + 1 up, so a shard never exceeds the limit and
+# keeps its ids as the catalog grows. Shards are written gzipped to
+# SITEMAP_DIR from a server-side cursor and reused until the row count or
+# the latest updated_at of their id range changes; neither building nor
+# serving one holds more than a batch of rows in memory.
+#----------------------------------------------------------------------------#
+
+KINDS = {'venues': Venue, 'artists': Artist}
+
+PAGES = ('index', 'venues', 'artists', 'shows')
+
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def lastmod(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class Sitemaps:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('SITEMAP_DIR')
+        self.per_shard = app.config.get('SITEMAP_URLS_PER_SHARD', 50000)
+        self.base_url = app.config.get('SITEMAP_BASE_URL')
+        app.add_url_rule('/sitemap.xml', 'sitemap_index', self.index)
+        app.add_url_rule('/sitemaps/pages.xml', 'sitemap_pages', self.pages)
+        app.add_url_rule('/sitemaps/<kind>-<int:shard>.xml.gz', 'sitemap_shard', self.shard)
+
+    def base(self):
+        return (self.base_url or request.url_root).rstrip('/')
+
+    def index(self):
+        base = self.base()
+
+        def generate():
+            yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{}">\n'.format(XMLNS)
+            yield '<sitemap><loc>{}/sitemaps/pages.xml</loc></sitemap>\n'.format(base)
+            for kind, model in KINDS.items():
+                # One row per shard, however many entities there are
+                shard = ((model.id - 1) / self.per_shard).label('shard')
+                for row in db.session.query(shard, func.max(model.updated_at)).group_by(shard).order_by(shard):
+                    yield '<sitemap><loc>{}/sitemaps/{}-{}.xml.gz</loc><lastmod>{}</lastmod></sitemap>\n'.format(
+                        base, kind, row[0], lastmod(row[1]))
+            yield '</sitemapindex>\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/xml')
+
+    def pages(self):
+        base = self.base()
+        urls = ''.join('<url><loc>{}{}</loc></url>\n'.format(
+            base, '/' if page == 'index' else '/' + page) for page in PAGES)
+        return Response('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{}">\n{}</urlset>\n'.format(
+            XMLNS, urls), mimetype='application/xml')
+
+    def shard(self, kind, shard):
+        model = KINDS.get(kind) or abort(404)
+        first, last = shard * self.per_shard + 1, (shard + 1) * self.per_shard
+        in_range = model.id.between(first, last)
+
+        count, latest = db.session.query(func.count(), func.max(model.updated_at)).filter(in_range).one()
+        if not count:
+            abort(404)
+        fingerprint = hashlib.sha1('{}|{}|{}'.format(count, latest, self.base()).encode()).hexdigest()[:16]
+        path = os.path.join(self.directory, '{}-{}-{}.xml.gz'.format(kind, shard, fingerprint))
+        if not os.path.exists(path):
+            self.build(path, kind, model, in_range)
+        return send_file(path, mimetype='application/gzip', conditional=True)
+
+    def build(self, path, kind, model, in_range):
+        """
+        Write one shard from a server-side cursor, then drop the files of
+        its older versions.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        base = self.base()
+        rows = db.session.query(model.id, model.updated_at).filter(in_range).order_by(model.id).execution_options(
+            stream_results=True).yield_per(1000)
+
+        partial = '{}.{}.tmp'.format(path, os.getpid())
+        with gzip.open(partial, 'wt', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{}">\n'.format(XMLNS))
+            for entity_id, updated_at in rows:
+                f.write('<url><loc>{}/{}/{}</loc><lastmod>{}</lastmod></url>\n'.format(
+                    base, kind, entity_id, lastmod(updated_at)))
+            f.write('</urlset>\n')
+        os.replace(partial, path)
+
+        prefix = path.rsplit('-', 1)[0]
+        for stale in glob.glob(prefix + '-*.xml.gz'):
+            if stale != path:
+                os.remove(stale)
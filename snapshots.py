@@ -0,0 +1,124 @@
+import gzip
+import os
+import threading
+import time
+import click
+from flask import current_app, request, send_file, url_for
+from flask.cli import AppGroup
+
+#----------------------------------------------------------------------------#
+# Static snapshots of listing pages.
+#
+# The pages in SNAPSHOT_PAGES look the same to every anonymous visitor, so
+# they are rendered once to <endpoint>.html (and .html.gz) in SNAPSHOT_DIR and
+# sent straight from disk. A page is rendered again in the background when a
+# listing cache generation it depends on is bumped in this worker; the
+# worker that made the write is the one that refreshes the files, which every
+# worker serves. Visitors with a session cookie (flashed messages) always get
+# the live page.
+#----------------------------------------------------------------------------#
+
+class Snapshots:
+
+    def __init__(self, app=None, listing_cache=None):
+        self.dirty = set()
+        self.thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        if app is not None:
+            self.init_app(app, listing_cache)
+
+    def init_app(self, app, listing_cache):
+        self.app = app
+        self.directory = app.config.get('SNAPSHOT_DIR')
+        self.pages = app.config.get('SNAPSHOT_PAGES', {})
+        self.compress = app.config.get('SNAPSHOT_COMPRESS', True)
+        self.delay = app.config.get('SNAPSHOT_DELAY', 1.0)
+        app.extensions['snapshots'] = self
+        app.cli.add_command(snapshots_cli)
+        if app.config.get('SNAPSHOT_SERVE'):
+            listing_cache.on_bump(self.invalidate)
+            app.before_request(self.serve)
+
+    def path(self, endpoint):
+        return os.path.join(self.directory, endpoint + '.html')
+
+    def render(self, endpoint):
+        """
+        Render one page as an anonymous GET and replace its files atomically.
+        """
+        with self.app.test_request_context():
+            path = url_for(endpoint)
+        with self.app.test_request_context(path):
+            body = self.app.make_response(self.app.view_functions[endpoint]()).get_data()
+
+        os.makedirs(self.directory, exist_ok=True)
+        files = [(self.path(endpoint), body)]
+        if self.compress:
+            files.append((self.path(endpoint) + '.gz', gzip.compress(body, 9, mtime=0)))
+        for name, data in files:
+            partial = '{}.{}.tmp'.format(name, os.getpid())
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, name)
+
+    def invalidate(self, kinds):
+        stale = {endpoint for endpoint, depends_on in self.pages.items() if set(depends_on) & set(kinds)}
+        if stale:
+            self.schedule(stale)
+
+    def schedule(self, endpoints):
+        with self._lock:
+            self.dirty.update(endpoints)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='fyyur-snapshots', daemon=True)
+                self.thread.start()
+        self._wake.set()
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            # Let a burst of writes settle into one render
+            time.sleep(self.delay)
+            self._wake.clear()
+            with self._lock:
+                endpoints, self.dirty = self.dirty, set()
+            for endpoint in endpoints:
+                try:
+                    self.render(endpoint)
+                except Exception:
+                    self.app.logger.exception('Snapshot of %s could not be rendered', endpoint)
+
+    def serve(self):
+        if request.method != 'GET' or request.endpoint not in self.pages:
+            return None
+        if self.app.config['SESSION_COOKIE_NAME'] in request.cookies:
+            return None
+
+        path = self.path(request.endpoint)
+        gzipped = self.compress and 'gzip' in request.headers.get('Accept-Encoding', '')
+        try:
+            response = send_file(path + '.gz' if gzipped else path, mimetype='text/html', conditional=True)
+        except FileNotFoundError:
+            # Not rendered yet; serve this one live and render it for the next
+            self.schedule({request.endpoint})
+            return None
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+snapshots_cli = AppGroup('snapshots', help='Render static snapshots of listing pages.')
+
+
+@snapshots_cli.command('build')
+def build_command():
+    """Render every snapshot page now."""
+    snapshots = current_app.extensions['snapshots']
+    for endpoint in sorted(snapshots.pages):
+        snapshots.render(endpoint)
+        click.echo('Rendered {}'.format(snapshots.path(endpoint)))
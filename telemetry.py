@@ -0,0 +1,69 @@
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Request telemetry.
+#----------------------------------------------------------------------------#
+
+class Telemetry:
+    """
+    Time each request and the SQL it runs, then hand a summary to every
+    subscriber registered with on_request(). Subscribers run on the request
+    thread and must not block.
+    """
+
+    def __init__(self, app=None):
+        self.request_subscribers = []
+        self.query_subscribers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        event.listen(Engine, 'before_cursor_execute', self.before_query)
+        event.listen(Engine, 'after_cursor_execute', self.after_query)
+
+    def on_request(self, fn):
+        self.request_subscribers.append(fn)
+        return fn
+
+    def on_query(self, fn):
+        self.query_subscribers.append(fn)
+        return fn
+
+    def start(self):
+        g.request_started = time.perf_counter()
+        g.db_time = 0.0
+        g.db_queries = 0
+
+    def finish(self, response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+
+        summary = {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'latency': time.perf_counter() - started,
+            'db_time': g.db_time,
+            'db_queries': g.db_queries,
+        }
+        for fn in self.request_subscribers:
+            fn(summary)
+        return response
+
+    def before_query(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    def after_query(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        if has_request_context() and 'db_time' in g:
+            g.db_time += elapsed
+            g.db_queries += 1
+        for fn in self.query_subscribers:
+            fn(statement, elapsed)
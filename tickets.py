@@ -0,0 +1,120 @@
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from models import db
+
+#----------------------------------------------------------------------------#
+# Ticket inventory.
+#
+# A show with a capacity has one Ticket row per seat. Holding seats claims
+# free rows with FOR UPDATE SKIP LOCKED, so buyers racing for the same show
+# each take different rows instead of waiting on one another; a seat can
+# only be sold by the token that holds it, so the show never oversells.
+# Holds lapse at held_until and their seats are claimed again by the next
+# buyer, without a cleanup job. All functions run in the caller's
+# transaction; the caller commits, or rolls back on an error.
+#----------------------------------------------------------------------------#
+
+class TicketError(Exception):
+    pass
+
+
+class SoldOut(TicketError):
+    pass
+
+
+class HoldExpired(TicketError):
+    pass
+
+
+class ShowStarted(TicketError):
+    pass
+
+
+CREATE = text(
+    'INSERT INTO "Ticket" (show_id, status) '
+    'SELECT show_id, \'available\' FROM unnest(CAST(:show_ids AS integer[])) AS show_id, '
+    'generate_series(1, :capacity)')
+
+HOLD = text(
+    'UPDATE "Ticket" SET status = \'held\', hold_token = :token, held_until = :until '
+    'WHERE id IN ('
+    '  SELECT id FROM "Ticket" WHERE show_id = :show_id '
+    '  AND (status = \'available\' OR (status = \'held\' AND held_until < :now)) '
+    '  AND EXISTS (SELECT 1 FROM "Show" WHERE "Show".id = :show_id AND "Show".start_time > :now) '
+    '  LIMIT :quantity FOR UPDATE SKIP LOCKED) '
+    'RETURNING id')
+
+STARTED = text('SELECT EXISTS (SELECT 1 FROM "Show" WHERE id = :show_id AND start_time <= :now)')
+
+PURCHASE = text(
+    'UPDATE "Ticket" SET status = \'sold\', sold_at = :now, held_until = NULL '
+    'WHERE hold_token = :token AND status = \'held\' AND held_until >= :now '
+    'AND EXISTS (SELECT 1 FROM "Show" WHERE "Show".id = "Ticket".show_id AND "Show".start_time > :now) '
+    'RETURNING id')
+
+RELEASE = text(
+    'UPDATE "Ticket" SET status = \'available\', hold_token = NULL, held_until = NULL '
+    'WHERE hold_token = :token AND status = \'held\'')
+
+AVAILABILITY = text(
+    'SELECT count(*) AS capacity, '
+    'count(*) FILTER (WHERE status = \'sold\') AS sold, '
+    'count(*) FILTER (WHERE status = \'held\' AND held_until >= :now) AS held '
+    'FROM "Ticket" WHERE show_id = :show_id')
+
+
+def create_tickets(show_ids, capacity):
+    """
+    Put `capacity` seats of every show in show_ids on sale.
+    """
+    if show_ids and capacity:
+        db.session.execute(CREATE, {'show_ids': list(show_ids), 'capacity': capacity})
+
+
+def hold(show_id, quantity, seconds):
+    """
+    Hold `quantity` seats for `seconds`, all or none. Returns the hold token,
+    the ticket ids and when the hold lapses. Raises SoldOut when not enough
+    seats are free right now (seats held by buyers still checking out may
+    come back), and ShowStarted once the show has begun.
+    """
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=seconds)
+    ids = db.session.execute(HOLD, {
+        'token': token, 'until': until, 'now': now, 'show_id': show_id, 'quantity': quantity,
+    }).scalars().all()
+    if len(ids) < quantity:
+        if db.session.execute(STARTED, {'show_id': show_id, 'now': now}).scalar():
+            raise ShowStarted('Show {} has already started.'.format(show_id))
+        raise SoldOut('Only {} of {} seats are available for show {}.'.format(len(ids), quantity, show_id))
+    return token, sorted(ids), until
+
+
+def purchase(token):
+    """
+    Sell every seat of a hold that has not lapsed, for a show that has not
+    started. Returns the ticket ids.
+    """
+    ids = db.session.execute(PURCHASE, {'token': token, 'now': datetime.utcnow()}).scalars().all()
+    if not ids:
+        raise HoldExpired('The hold has expired, was already used, or its show has started.')
+    return sorted(ids)
+
+
+def release(token):
+    """
+    Give the seats of a hold back before it lapses.
+    """
+    return db.session.execute(RELEASE, {'token': token}).rowcount
+
+
+def availability(show_id):
+    row = db.session.execute(AVAILABILITY, {'show_id': show_id, 'now': datetime.utcnow()}).one()
+    return {
+        'capacity': row.capacity,
+        'sold': row.sold,
+        'held': row.held,
+        'available': row.capacity - row.sold - row.held,
+    }
@@ -0,0 +1,167 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, text
+from models import db, Venue, Artist, ViewCount
+from projections import Trending, project
+
+#----------------------------------------------------------------------------#
+# Trending venues and artists.
+#
+# Page views are counted in memory, per UTC day, and written behind: every
+# TRENDING_FLUSH_INTERVAL seconds a background thread adds the counts to
+# ViewCount in one upsert, so a page view never writes to the database. If
+# the write fails the counts are kept for the next flush, and the last
+# flush runs when the worker exits.
+#
+# The leaderboards sum the last TRENDING_DAYS days of ViewCount. They sit in
+# the listing cache under the 'trending' generation, which the same thread
+# bumps every TRENDING_REFRESH seconds (and with it the home page snapshot).
+#----------------------------------------------------------------------------#
+
+KINDS = {'venue': Venue, 'artist': Artist}
+
+UPSERT = text(
+    'INSERT INTO "ViewCount" (kind, day, entity_id, views) '
+    'SELECT * FROM unnest(CAST(:kinds AS varchar[]), CAST(:days AS date[]), '
+    '                     CAST(:ids AS integer[]), CAST(:views AS integer[])) '
+    'ON CONFLICT (kind, day, entity_id) DO UPDATE SET views = "ViewCount".views + excluded.views')
+
+PURGE = text('DELETE FROM "ViewCount" WHERE day < :before')
+
+
+class ViewCounter:
+    """
+    Thread-safe view counts waiting to be written.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, kind, entity_id, views=1):
+        with self._lock:
+            self.counts[kind, datetime.utcnow().date(), entity_id] += views
+
+    def take(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def put_back(self, counts):
+        with self._lock:
+            self.counts.update(counts)
+
+
+def upsert(conn, counts):
+    # Sorted, so that workers flushing at once lock rows in the same order
+    rows = sorted(counts.items())
+    conn.execute(UPSERT, {
+        'kinds': [kind for (kind, day, entity_id), views in rows],
+        'days': [day for (kind, day, entity_id), views in rows],
+        'ids': [entity_id for (kind, day, entity_id), views in rows],
+        'views': [views for key, views in rows],
+    })
+
+
+def leaderboard(kind, days, size):
+    model = KINDS[kind]
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    views = func.sum(ViewCount.views)
+    return project(Trending, db.session.query(model.id, model.name, model.image_link, views).join(
+        ViewCount, and_(ViewCount.kind == kind, ViewCount.day >= since, ViewCount.entity_id == model.id)).group_by(
+        model.id).order_by(views.desc(), model.id).limit(size))
+
+
+class TrendingViews:
+
+    def __init__(self, app=None, listing_cache=None):
+        self.counter = ViewCounter()
+        self.thread = None
+        self.flushed = 0
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        if app is not None:
+            self.init_app(app, listing_cache)
+
+    def init_app(self, app, listing_cache):
+        self.app = app
+        self.listing_cache = listing_cache
+        self.interval = app.config.get('TRENDING_FLUSH_INTERVAL', 30)
+        self.refresh = app.config.get('TRENDING_REFRESH', 300)
+        self.days = app.config.get('TRENDING_DAYS', 7)
+        self.size = app.config.get('TRENDING_SIZE', 5)
+        app.before_request(self.start)
+        app.jinja_env.globals['trending'] = self.trending
+        app.cli.add_command(trending_cli)
+        app.extensions['trending'] = self
+        atexit.register(self.flush)
+
+    def viewed(self, kind, entity_id):
+        self.counter.add(kind, entity_id)
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='fyyur-trending', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        refreshed = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+            if time.monotonic() - refreshed >= self.refresh:
+                refreshed = time.monotonic()
+                self.listing_cache.bump('trending')
+
+    def flush(self):
+        """
+        Write the pending counts; on failure keep them for the next flush.
+        """
+        # Held for the whole write, so the flush at exit waits for one the
+        # thread has already started
+        with self._flushing:
+            counts = self.counter.take()
+            if not counts:
+                return 0
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        upsert(conn, counts)
+            except Exception:
+                self.counter.put_back(counts)
+                self.app.logger.exception('View counts could not be flushed')
+                return 0
+            self.flushed += sum(counts.values())
+            return len(counts)
+
+    def trending(self):
+        """
+        The leaderboards, as {'venues': [Trending], 'artists': [Trending]}.
+        """
+        return self.listing_cache.get_or_build('trending', ('venues', 'artists', 'trending'), lambda: {
+            'venues': leaderboard('venue', self.days, self.size),
+            'artists': leaderboard('artist', self.days, self.size),
+        })
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+trending_cli = AppGroup('trending', help='Maintain the view counts behind trending.')
+
+
+@trending_cli.command('purge')
+@click.option('--days', default=None, type=int, help='Keep this many days (default: twice TRENDING_DAYS).')
+def purge_command(days):
+    """Delete view counts that no leaderboard reads; run daily from cron."""
+    days = days or 2 * current_app.config.get('TRENDING_DAYS', 7)
+    with db.engine.begin() as conn:
+        deleted = conn.execute(PURGE, {'before': datetime.utcnow().date() - timedelta(days=days)}).rowcount
+    click.echo('Deleted {} count(s)'.format(deleted))